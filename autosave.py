@@ -0,0 +1,108 @@
+import time
+import threading
+from collections import deque
+
+
+class AutosaveService:
+    '''
+    Saves events in the background after an interval or a number of edits.
+    The snapshot is taken on the GUI thread (cached per-event dicts, so it's cheap),
+    serialization and writing are done on a worker thread with atomic file replacement
+    '''
+    def __init__(self, event_manager, path, journal=None, interval=30.0, max_edits=20):
+        self.event_manager = event_manager
+        self.path = path
+        self.journal = journal                   # log of changes that is dropped after a successful save
+        self.interval = interval
+        self.max_edits = max_edits
+        self._edits = 0
+        self._last_save = time.monotonic()
+        self._thread = None
+        self._save_times = deque(maxlen=100)     # ms
+        self.num_saves = 0
+        self.last_error = None
+        self.enabled = True
+        event_manager.add_listener(self.on_event_changed)
+
+    def on_event_changed(self, action, event):
+        self._edits += 1
+
+    @property
+    def dirty(self):
+        # A failed save is retried:
+        return self._edits > 0 or self.last_error is not None
+
+    @property
+    def saving(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def poll(self):
+        '''
+        Called from the GUI loop, starts saving if it's due. Returns True if saving is started
+        '''
+        if not self.enabled or not self.dirty or self.saving:
+            return False
+        if self._edits >= self.max_edits or time.monotonic() - self._last_save >= self.interval:
+            return self.save()
+        return False
+
+    def next_save_delay(self):
+        '''
+        Returns time in ms until pending changes are saved by interval (or None)
+        '''
+        if not self.enabled or not self.dirty:
+            return None
+        return max(0, int((self.interval - (time.monotonic() - self._last_save)) * 1000))
+
+    def save(self, wait=False):
+        if self.saving:
+            self._thread.join()
+
+        data = self.event_manager.to_dict()
+        if self.journal is not None:
+            self.journal.rotate()
+        self._edits = 0
+        self._last_save = time.monotonic()
+        self._thread = threading.Thread(target=self._write, args=(data,), daemon=True)
+        self._thread.start()
+        if wait:
+            self._thread.join()
+        return True
+
+    def flush(self):
+        '''
+        Saves pending changes and waits until they are written
+        '''
+        if self.dirty:
+            self.save(wait=True)
+        elif self.saving:
+            self._thread.join()
+
+    def close(self, save=True):
+        self.event_manager.remove_listener(self.on_event_changed)
+        if save:
+            self.flush()
+        elif self.saving:
+            self._thread.join()
+
+    def last_save_ms(self):
+        '''
+        Returns duration of the last save and mean duration in ms (or None)
+        '''
+        if len(self._save_times) == 0:
+            return None, None
+        return self._save_times[-1], sum(self._save_times) / len(self._save_times)
+
+    def _write(self, data):
+        start = time.perf_counter()
+        try:
+            self.event_manager.write_snapshot(data, self.path)
+        except OSError as e:
+            self.last_error = e
+            print ('[Warning] Failed to save events to {}: {}'.format(self.path, e))
+            return
+        self.last_error = None
+        self._save_times.append((time.perf_counter() - start) * 1000.0)
+        self.num_saves += 1
+        if self.journal is not None:
+            self.journal.retire()
@@ -0,0 +1,280 @@
+'''
+Headless benchmark of the decode -> buffer -> display pipeline of VideoPlayer.
+
+Also measures memory of event sets (slotted Event vs. the same class with __dict__).
+
+Usage:
+    python -m bench --resolutions 1280x720,1920x1080 --buffer-sizes 5,30 --output bench_results.json
+    python -m bench --resolutions '' --events 100000
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import multiprocessing
+from datetime import datetime
+import numpy as np
+import cv2
+from PIL import Image
+
+from video_player import VideoPlayer, disable_opencv_multithreading
+from event_types import EventTypes
+from event_manager import Event, EventManager
+
+try:
+    import resource
+except ImportError:                                  # not available on Windows
+    resource = None
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max())
+    }
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux:
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def generate_video(path, size, fps, duration, gop=None):
+    '''
+    Writes a synthetic video with moving content, so the encoder can't skip frames
+    '''
+    if os.path.exists(path):
+        return path
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    assert writer.isOpened(), 'Cannot write {}'.format(path)
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    for frame_id in range(int(fps * duration)):
+        frame = np.roll(background, frame_id * 4, axis=1)
+        cv2.putText(frame, str(frame_id), (size[0] // 10, size[1] // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    size[1] / 200, (255, 255, 255), max(1, size[1] // 100))
+        writer.write(frame)
+    writer.release()
+
+    return path
+
+
+def wait_frame(player, display_size, frame_id, timeout=10.0):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        _, frame = player.get_frame(display_size)
+        if frame is not None and player.frame_id == frame_id:
+            return time.perf_counter() - start
+    return None
+
+
+def bench_player(video_path, display_size, buffer_size, num_workers, num_frames, num_seeks, seed=0):
+    player = VideoPlayer(buffer_size, buffer_bytes=None, cache_bytes=0, num_workers=num_workers)
+    player.open(video_path, resolution=display_size)
+    total_frames = min(num_frames, player.num_frames)
+    result = {'buffer_size': buffer_size, 'num_workers': num_workers, 'shm_mb': player.buffer_nbytes() / 2**20}
+
+    # Warm up: wait for the first frame at the target resolution:
+    player.rewind(0)
+    wait_frame(player, display_size, 0)
+
+    # Sustained throughput: consume every frame as fast as the pipeline delivers it:
+    occupancy, get_ms, wrap_ms = [], [], []
+    shown = 0
+    start = time.perf_counter()
+    while shown < total_frames - 1:
+        player.update_playback_anchor()              # request the next frame without pacing
+        t = time.perf_counter()
+        stopped, frame = player.get_frame(display_size)
+        get_ms.append((time.perf_counter() - t) * 1000.0)
+        occupancy.append(player.buffer_occupancy()[0])
+        if frame is not None:
+            # The GUI only wraps display-ready bytes:
+            t = time.perf_counter()
+            Image.frombuffer('RGB', display_size, frame, 'raw', 'RGB', 0, 1).load()
+            wrap_ms.append((time.perf_counter() - t) * 1000.0)
+            shown += 1
+        elif stopped:
+            break
+        else:
+            time.sleep(0.0005)
+    elapsed = time.perf_counter() - start
+    result['sustained_fps'] = shown / elapsed if elapsed > 0 else 0.0
+    result['get_frame_ms'] = percentiles(get_ms)
+    result['wrap_ms'] = percentiles(wrap_ms)
+    result['buffer_occupancy'] = {
+        'mean': float(np.mean(occupancy)) if len(occupancy) else 0.0,
+        'max': int(np.max(occupancy)) if len(occupancy) else 0,
+        'slots': player.buffer_occupancy()[1]
+    }
+
+    # Seek latency as seen by the consumer (rewind -> target frame shown):
+    rng = random.Random(seed)
+    seek_ms, timeouts = [], 0
+    for _ in range(num_seeks):
+        target = rng.randrange(0, player.num_frames)
+        player.rewind(target)
+        latency = wait_frame(player, display_size, target)
+        if latency is None:
+            timeouts += 1
+        else:
+            seek_ms.append(latency * 1000.0)
+    result['seek_ms'] = percentiles(seek_ms)
+    result['seek_timeouts'] = timeouts
+    result['worker_seek_ms'] = player.seek_latency()[1]
+
+    # The last frame is a view of the shared buffer, which can't be unmapped while it's referenced:
+    frame = None
+    player.release()
+    result['max_rss_mb'] = max_rss_mb()
+
+    return result
+
+
+class DictEvent:
+    '''
+    Event with a per-instance __dict__ (the representation before __slots__)
+    '''
+    __init__ = Event.__init__
+
+
+def create_events(event_class, event_types, num_events, seed=0):
+    rng = random.Random(seed)
+    types = [(supertype, type) for supertype in event_types.supertypes for type in event_types.supertypes[supertype].types]
+    events = {}
+    for event_id in range(1, num_events + 1):
+        supertype, type = rng.choice(types)
+        start_idx = rng.randrange(0, 90 * 60 * 25)
+        events[event_id] = event_class(event_id, supertype, type, start_idx, start_idx + rng.randrange(0, 500),
+                                       rng.choice(['home_team', 'away_team']), [rng.randrange(1, 30)], [],
+                                       start_cause='1', end_cause='2')
+    return events
+
+
+def traced_mb(func):
+    '''
+    Returns (result, MB allocated and still held by the result)
+    '''
+    tracemalloc.start()
+    try:
+        result = func()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current / 2**20
+
+
+def bench_event_memory(num_events):
+    event_types = EventTypes()
+    result = {'num_events': num_events}
+    for name, event_class in [('slots', Event), ('dict', DictEvent)]:
+        start = time.perf_counter()
+        _, mb = traced_mb(lambda: create_events(event_class, event_types, num_events))
+        result[name] = {'mb': mb, 'bytes_per_event': mb * 2**20 / num_events,
+                        'create_s': time.perf_counter() - start}
+
+    # Whole manager (events, interval index, serialized snapshot cache):
+    def create_manager():
+        event_manager = EventManager(event_types, 'home', 'away')
+        for event_id, e in create_events(Event, event_types, num_events).items():
+            event_manager.create_event(e.supertype, e.type, e.start_idx, event_id=event_id, end_idx=e.end_idx,
+                                       team_key=e.team_key, players=e.players, enemy_players=e.enemy_players,
+                                       start_cause=e.start_cause, end_cause=e.end_cause)
+        event_manager.to_dict()
+        return event_manager
+    _, mb = traced_mb(create_manager)
+    result['event_manager_mb'] = mb
+
+    return result
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Headless benchmark of the VideoPlayer pipeline')
+    parser.add_argument('--resolutions', default='640x360,1280x720,1920x1080',
+                        help='comma-separated source resolutions of synthetic videos')
+    parser.add_argument('--display-size', default='960x540', help='size of displayed frames')
+    parser.add_argument('--buffer-sizes', default='5,30', help='comma-separated buffer sizes')
+    parser.add_argument('--workers', default='1', help='comma-separated numbers of decode workers')
+    parser.add_argument('--fps', type=int, default=25)
+    parser.add_argument('--duration', type=float, default=20.0, help='duration of synthetic videos in seconds')
+    parser.add_argument('--frames', type=int, default=300, help='frames to play for the throughput test')
+    parser.add_argument('--seeks', type=int, default=20, help='number of random seeks')
+    parser.add_argument('--work-dir', default=None, help='where to keep synthetic videos (temporary dir by default)')
+    parser.add_argument('--events', type=int, default=100000,
+                        help='number of synthetic events for the memory benchmark (0 to skip)')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('-cvmp', '--enable_cvmp', action='store_true', default=False,
+                        help='enable multithreading for opencv')
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if not args.enable_cvmp:
+        disable_opencv_multithreading()
+
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    display_size = parse_size(args.display_size)
+
+    results = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'display_size': list(display_size),
+        'runs': []
+    }
+
+    for resolution in [r for r in args.resolutions.split(',') if len(r) > 0]:
+        size = parse_size(resolution)
+        name = 'synthetic_{}x{}_{}fps_{}s.mp4'.format(size[0], size[1], args.fps, int(args.duration))
+        video_path = generate_video(os.path.join(work_dir, name), size, args.fps, args.duration)
+        # Frames are never upscaled:
+        run_display_size = display_size if display_size[0] <= size[0] else size
+
+        for num_workers in [int(w) for w in args.workers.split(',')]:
+            for buffer_size in [int(b) for b in args.buffer_sizes.split(',')]:
+                print ('Benchmarking {} workers={} buffer_size={}...'.format(resolution, num_workers, buffer_size))
+                run = bench_player(video_path, run_display_size, buffer_size, num_workers, args.frames, args.seeks)
+                run['resolution'] = resolution
+                results['runs'].append(run)
+                print ('  {:.1f} fps, seek p50 {:.1f} ms'.format(
+                    run['sustained_fps'], run['seek_ms']['p50'] if run['seek_ms'] else float('nan')))
+
+    if args.events > 0:
+        print ('Benchmarking memory of {} events...'.format(args.events))
+        results['events'] = bench_event_memory(args.events)
+        print ('  slots: {:.1f} MB, dict: {:.1f} MB, EventManager: {:.1f} MB'.format(
+            results['events']['slots']['mb'], results['events']['dict']['mb'], results['events']['event_manager_mb']))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=3)
+    print ('Results are saved to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,126 @@
+import os
+import glob
+import numpy as np
+
+
+FRAMES_SUFFIX = '.frames.npy'
+INDEX_SUFFIX = '.index.npy'
+
+
+def get_frame_cache_dir(video_dir):
+    return os.path.join(video_dir, '.frame_cache')
+
+
+def get_frame_cache_name(video_key, resolution, worker_idx=0):
+    return '{}_{}x{}_{}'.format(video_key, resolution[0], resolution[1], worker_idx)
+
+
+class DiskFrameCache:
+    '''
+    Display-ready RGB frames of one video at one resolution in a memory-mapped fixed-stride file,
+    so replaying a segment copies frames instead of decoding them again.
+    The index maps slots to (frame id, last use), when the file is full the least recently used slot is overwritten.
+    Each capture worker has its own file, so no locking is needed
+    '''
+    def __init__(self, cache_dir, video_key, resolution, max_bytes, worker_idx=0):
+        width, height = resolution
+        self.frame_shape = (height, width, 3)
+        num_slots = max(1, max_bytes // (width * height * 3))
+        name = get_frame_cache_name(video_key, resolution, worker_idx)
+        self.path = os.path.join(cache_dir, name + FRAMES_SUFFIX)
+        self.index_path = os.path.join(cache_dir, name + INDEX_SUFFIX)
+
+        self._frames, self._index = self._open(num_slots)
+        self._slots = {int(frame_id): slot for slot, frame_id in enumerate(self._index[:, 0].tolist()) if frame_id >= 0}
+        self._tick = int(self._index[:, 1].max()) + 1
+
+    def _open(self, num_slots):
+        shape = (num_slots,) + self.frame_shape
+        try:
+            frames = np.load(self.path, mmap_mode='r+')
+            index = np.load(self.index_path, mmap_mode='r+')
+            if frames.shape == shape and frames.dtype == np.uint8 and index.shape == (num_slots, 2):
+                os.utime(self.path)                                  # files are evicted by the time of last use
+                return frames, index
+        except (OSError, ValueError):
+            pass
+
+        # Create new files (the size cap has changed or the files are missing or broken):
+        index = np.lib.format.open_memmap(self.index_path, mode='w+', dtype=np.int64, shape=(num_slots, 2))
+        index[:] = -1                                                # frame id, last use
+        frames = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.uint8, shape=shape)
+        return frames, index
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, frame_id):
+        return frame_id in self._slots
+
+    def read(self, frame_id, out):
+        '''
+        Copies the cached frame into out, returns False if the frame is not cached
+        '''
+        slot = self._slots.get(frame_id, None)
+        if slot is None:
+            return False
+        out[:] = self._frames[slot]
+        self._index[slot, 1] = self._tick
+        self._tick += 1
+        return True
+
+    def write(self, frame_id, frame):
+        assert frame.shape == self.frame_shape
+        if frame_id in self._slots:
+            return
+
+        # Free slots have the smallest last use (-1), then the least recently used one is overwritten:
+        slot = int(np.argmin(self._index[:, 1]))
+        old_frame_id = int(self._index[slot, 0])
+        if old_frame_id >= 0:
+            del self._slots[old_frame_id]
+
+        # The slot is invalid while it's being overwritten:
+        self._index[slot, 0] = -1
+        self._frames[slot] = frame
+        self._index[slot] = (frame_id, self._tick)
+        self._tick += 1
+        self._slots[frame_id] = slot
+
+    def close(self):
+        self._frames.flush()
+        self._index.flush()
+        self._frames = None
+        self._index = None
+        self._slots = {}
+
+    @staticmethod
+    def evict(cache_dir, max_bytes, keep=()):
+        '''
+        Deletes the least recently used cache files until the disk space they take fits into max_bytes.
+        Files of names starting with the keep prefixes are not deleted
+        '''
+        entries = []
+        for path in glob.glob(os.path.join(cache_dir, '*' + FRAMES_SUFFIX)):
+            name = os.path.basename(path)[:-len(FRAMES_SUFFIX)]
+            index_path = os.path.join(cache_dir, name + INDEX_SUFFIX)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Files are sparse, so only the written frames take disk space:
+            nbytes = stat.st_blocks * 512 if hasattr(stat, 'st_blocks') else stat.st_size
+            entries.append((stat.st_mtime, nbytes, name, path, index_path))
+
+        total = sum(entry[1] for entry in entries)
+        for _, nbytes, name, path, index_path in sorted(entries):
+            if total <= max_bytes:
+                break
+            if name.startswith(tuple(keep)):
+                continue
+            try:
+                os.remove(index_path)
+                os.remove(path)
+            except OSError:
+                continue                                             # e.g. it's still mapped on Windows
+            total -= nbytes
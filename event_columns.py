@@ -0,0 +1,161 @@
+'''
+Columnar (NumPy .npz) storage of events, a compact alternative to _events.json.
+
+Each event field is stored as a column: frames as int32 (NO_FRAME for None), strings and other values
+dictionary-encoded (int32 codes into a table of JSON-encoded values, -1 if the key is absent)
+and player lists as ragged arrays (offsets into one flat column of codes).
+Loading returns exactly the dict that EventManager.to_dict() produces
+'''
+import json
+import numpy as np
+
+FORMAT_VERSION = 2                # version 1 stored None frames as -1, so negative frames couldn't be kept
+ZIP_MAGIC = b'PK\x03\x04'
+NO_VALUE = -1
+NO_FRAME = np.iinfo(np.int32).min
+
+FRAME_FIELDS = ('start_frame', 'end_frame')
+VALUE_FIELDS = ('supertype', 'type', 'team_key', 'start_cause', 'end_cause', 'start_zone', 'end_zone')
+LIST_FIELDS = ('players', 'enemy_players')
+
+# Kinds of player values (the GUI may store the raw input string instead of a list):
+KIND_LIST = 0
+KIND_VALUE = 1
+
+
+def is_columnar(path):
+    with open(path, 'rb') as f:
+        return f.read(len(ZIP_MAGIC)) == ZIP_MAGIC
+
+
+class ValueEncoder:
+    '''
+    Dictionary encoder of arbitrary JSON values
+    '''
+    def __init__(self):
+        self.codes = {}
+
+    def encode(self, value):
+        key = json.dumps(value, ensure_ascii=False)
+        code = self.codes.get(key, None)
+        if code is None:
+            code = self.codes[key] = len(self.codes)
+        return code
+
+    def table(self):
+        return np.array(list(self.codes.keys()), dtype=np.str_)
+
+
+def decode_table(table):
+    return [json.loads(value) for value in table.tolist()]
+
+
+def to_columns(data):
+    '''
+    Converts the dict of EventManager.to_dict() to a dict of arrays
+    '''
+    events = {int(event_id): event for event_id, event in data['events'].items()}
+    event_ids = sorted(events.keys())
+    num_events = len(event_ids)
+
+    columns = {
+        'format_version': np.array(FORMAT_VERSION, dtype=np.int32),
+        'meta': np.array(json.dumps({key: value for key, value in data.items() if key != 'events'},
+                                    ensure_ascii=False)),
+        'event_id': np.array(event_ids, dtype=np.int32)
+    }
+
+    for field in FRAME_FIELDS:
+        frames = np.full(num_events, NO_FRAME, dtype=np.int32)
+        for i, event_id in enumerate(event_ids):
+            frame = events[event_id].get(field, None)
+            if frame is not None:
+                frames[i] = frame                # negative frames are kept, the validator reports them
+        columns[field] = frames
+
+    for field in VALUE_FIELDS:
+        encoder = ValueEncoder()
+        codes = np.full(num_events, NO_VALUE, dtype=np.int32)
+        for i, event_id in enumerate(event_ids):
+            if field in events[event_id]:
+                codes[i] = encoder.encode(events[event_id][field])
+        columns[field] = codes
+        columns[field + '_values'] = encoder.table()
+
+    for field in LIST_FIELDS:
+        encoder = ValueEncoder()
+        kinds = np.zeros(num_events, dtype=np.int8)
+        offsets = np.zeros(num_events + 1, dtype=np.int64)
+        items = []
+        for i, event_id in enumerate(event_ids):
+            value = events[event_id][field]
+            if isinstance(value, list):
+                items.extend(encoder.encode(item) for item in value)
+            else:
+                kinds[i] = KIND_VALUE
+                items.append(encoder.encode(value))
+            offsets[i+1] = len(items)
+        columns[field + '_kind'] = kinds
+        columns[field + '_offsets'] = offsets
+        columns[field] = np.array(items, dtype=np.int32)
+        columns[field + '_values'] = encoder.table()
+
+    return columns
+
+
+def from_columns(columns):
+    '''
+    Converts a dict of arrays back to the dict of EventManager.to_dict()
+    '''
+    if int(columns['format_version']) != FORMAT_VERSION:
+        raise ValueError('Unsupported version of columnar events: {}'.format(int(columns['format_version'])))
+
+    data = json.loads(str(columns['meta']))
+    event_ids = columns['event_id'].tolist()
+    events = {event_id: {} for event_id in event_ids}
+
+    for field in VALUE_FIELDS:
+        values = decode_table(columns[field + '_values'])
+        for event_id, code in zip(event_ids, columns[field].tolist()):
+            if code != NO_VALUE:
+                events[event_id][field] = values[code]
+
+    for field in FRAME_FIELDS:
+        for event_id, frame in zip(event_ids, columns[field].tolist()):
+            events[event_id][field] = frame if frame != NO_FRAME else None
+
+    for field in LIST_FIELDS:
+        values = decode_table(columns[field + '_values'])
+        items = [values[code] for code in columns[field].tolist()]
+        offsets = columns[field + '_offsets'].tolist()
+        for i, (event_id, kind) in enumerate(zip(event_ids, columns[field + '_kind'].tolist())):
+            value = items[offsets[i]:offsets[i+1]]
+            events[event_id][field] = value if kind == KIND_LIST else value[0]
+
+    data['events'] = events
+
+    return data
+
+
+def save(data, f):
+    '''
+    Writes events to a path or a file object
+    '''
+    np.savez_compressed(f, **to_columns(data))
+
+
+def load_columns(path):
+    with np.load(path, allow_pickle=False) as npz:
+        columns = {key: npz[key] for key in npz.files}
+
+    # Files of version 1 are upgraded on load:
+    if int(columns['format_version']) == 1:
+        for field in FRAME_FIELDS:
+            columns[field] = np.where(columns[field] == NO_VALUE, NO_FRAME, columns[field]).astype(np.int32)
+        columns['format_version'] = np.array(FORMAT_VERSION, dtype=np.int32)
+
+    return columns
+
+
+def load(path):
+    return from_columns(load_columns(path))
@@ -0,0 +1,94 @@
+import bisect
+
+
+class EventIndex:
+    '''
+    Incrementally maintained index of event intervals [start_idx, end_idx] for O(log n) queries by frame.
+    Unfinished events (end_idx is None) are indexed as points at start_idx
+    '''
+    def __init__(self):
+        self._intervals = {}                     # event_id -> (start, end)
+        self._starts = []                        # sorted (start, event_id)
+        self._bounds = []                        # sorted (frame, event_id) of both starts and ends
+        self._buckets = {}                       # length.bit_length() -> sorted (start, event_id) to bound overlap scans
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __contains__(self, event_id):
+        return event_id in self._intervals
+
+    def clear(self):
+        self.__init__()
+
+    def add(self, event_id, start, end=None):
+        assert event_id not in self._intervals
+        end = start if end is None or end < start else end
+        self._intervals[event_id] = (start, end)
+        bisect.insort(self._starts, (start, event_id))
+        bisect.insort(self._bounds, (start, event_id))
+        bisect.insort(self._bounds, (end, event_id))
+        bisect.insort(self._buckets.setdefault((end - start).bit_length(), []), (start, event_id))
+
+    def remove(self, event_id):
+        if event_id not in self._intervals:
+            return False
+        start, end = self._intervals.pop(event_id)
+        self._remove_item(self._starts, (start, event_id))
+        self._remove_item(self._bounds, (start, event_id))
+        self._remove_item(self._bounds, (end, event_id))
+        bucket = (end - start).bit_length()
+        self._remove_item(self._buckets[bucket], (start, event_id))
+        if len(self._buckets[bucket]) == 0:
+            del self._buckets[bucket]
+        return True
+
+    def update(self, event_id, start, end=None):
+        self.remove(event_id)
+        self.add(event_id, start, end)
+
+    def overlap(self, start, end=None):
+        '''
+        Returns ids of events overlapping [start, end] ordered by their start
+        '''
+        end = start if end is None else end
+        found = []
+
+        # Events are bucketed by length below a power of two, so one long event doesn't widen the scan of short ones:
+        for bucket, starts in self._buckets.items():
+            lo = bisect.bisect_left(starts, (start - (1 << bucket) + 1, -float('inf')))
+            hi = bisect.bisect_right(starts, (end, float('inf')))
+            found.extend(item for item in starts[lo:hi] if self._intervals[item[1]][1] >= start)
+        found.sort()
+        return [event_id for _, event_id in found]
+
+    def at(self, frame_id):
+        return self.overlap(frame_id, frame_id)
+
+    def in_range(self, start, end):
+        '''
+        Returns ids of events starting within [start, end] ordered by their start
+        '''
+        lo = bisect.bisect_left(self._starts, (start, -float('inf')))
+        hi = bisect.bisect_right(self._starts, (end, float('inf')))
+        return [event_id for _, event_id in self._starts[lo:hi]]
+
+    def next_boundary(self, frame_id):
+        '''
+        Returns (frame, event_id) of the closest event start or end after frame_id or None
+        '''
+        i = bisect.bisect_right(self._bounds, (frame_id, float('inf')))
+        return self._bounds[i] if i < len(self._bounds) else None
+
+    def prev_boundary(self, frame_id):
+        '''
+        Returns (frame, event_id) of the closest event start or end before frame_id or None
+        '''
+        i = bisect.bisect_left(self._bounds, (frame_id, -float('inf')))
+        return self._bounds[i-1] if i > 0 else None
+
+    @staticmethod
+    def _remove_item(items, item):
+        i = bisect.bisect_left(items, item)
+        assert i < len(items) and items[i] == item
+        del items[i]
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import datetime
+
+
+def get_journal_path(events_path):
+    return os.path.splitext(events_path)[0] + '.journal'
+
+
+class EventJournal:
+    '''
+    Append-only log of event changes written alongside the events file (one JSON record per line).
+    Records hold the full state of an event, so replaying them over any older snapshot is idempotent.
+    Before a snapshot is saved the log is rotated, and the rotated log is retired once the snapshot is written.
+    Every log starts with the session of the event manager, the log is not replayed over a snapshot of another
+    session (e.g. the log of new events after the saved file was declined)
+    '''
+    def __init__(self, events_path, fsync_every=20, fsync_interval=1.0):
+        self.events_path = events_path
+        self.path = get_journal_path(events_path)
+        self.old_path = self.path + '.old'        # the log being saved to the snapshot
+        self._fsync_every = fsync_every
+        self._fsync_interval = fsync_interval
+        self._event_manager = None
+        self._file = None
+        self._logged = False                     # the log has changes besides its session
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+        self.recovered = False
+
+    def attach(self, event_manager, resume=True):
+        '''
+        Starts logging changes of event_manager.
+        If resume is False the old log (e.g. of rejected changes) is not replayed but kept in a backup
+        '''
+        self._event_manager = event_manager
+        if not resume or not self.belongs_to(event_manager.session):
+            self._backup()
+        self.recovered = os.path.exists(self.path) or os.path.exists(self.old_path)
+        self._open_log()
+        if self.recovered:
+            # The log may end with a torn record, so new records are appended to a new one:
+            self.rotate()
+        else:
+            # Team names are needed to restore events without a snapshot:
+            self._append({'op': 'teams', 'home_team': event_manager.teams['home_team'],
+                          'away_team': event_manager.teams['away_team']})
+        event_manager.add_listener(self.on_event_changed)
+
+    def belongs_to(self, session):
+        '''
+        Returns True if the logs were written in the given session (logs written before sessions belong to any)
+        '''
+        return all(EventJournal._read_session(log_path, session) == session for log_path in (self.old_path, self.path))
+
+    def on_event_changed(self, action, event):
+        record = {'op': action, 'id': event.event_id}
+        if action != self._event_manager.DELETED:
+            record['event'] = self._event_manager.event_to_dict(event)
+        self._append(record)
+
+    def flush(self):
+        if self._file is not None and self._unsynced > 0:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._last_fsync = time.monotonic()
+
+    def poll(self):
+        '''
+        Syncs the records of an idle log once fsync_interval has passed (called from the GUI loop)
+        '''
+        if self.next_sync_delay() == 0:
+            self.flush()
+
+    def next_sync_delay(self):
+        '''
+        Returns milliseconds until the logged records are due to be synced or None if there is nothing to sync
+        '''
+        if self._file is None or self._unsynced == 0:
+            return None
+        return max(0, int((self._last_fsync + self._fsync_interval - time.monotonic()) * 1000))
+
+    def close(self, discard=False):
+        '''
+        Stops logging. With discard=True all logged changes are dropped, otherwise the log is kept
+        until the snapshot with its changes is saved
+        '''
+        if self._event_manager is None:
+            return
+        self._event_manager.remove_listener(self.on_event_changed)
+        self.flush()
+        self._file.close()
+        self._file = None
+        if discard or not self._logged:
+            self._remove(self.path)
+        if discard:
+            self._remove(self.old_path)
+        self._event_manager = None
+
+    def _open_log(self):
+        # Every log starts with the session, so it's never replayed over a snapshot of another session:
+        self._file = open(self.path, 'a')
+        self._logged = True
+        if os.path.getsize(self.path) == 0:
+            self._append({'op': 'session', 'session': self._event_manager.session})
+            self._logged = False                         # there are no changes in the log yet
+
+    def _append(self, record):
+        # Every record is handed to the OS, so it survives a crash of the player:
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._unsynced += 1
+        self._logged = True
+
+        # fsync is batched, at most fsync_every records or fsync_interval seconds are at risk on power loss
+        # (poll() syncs the tail of an idle log):
+        if self._unsynced >= self._fsync_every or time.monotonic() - self._last_fsync >= self._fsync_interval:
+            self.flush()
+
+    def _backup(self):
+        '''
+        Moves the old log to a timestamped backup, which is not replayed but keeps unsaved work recoverable
+        '''
+        backup_path = None
+        for path in (self.old_path, self.path):
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                self._remove(path)
+                continue
+            if backup_path is None:
+                backup_path = '{}.{}.bak'.format(self.path, datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+            # The rotated log goes first, so the backup can be replayed in order:
+            with open(backup_path, 'ab') as backup, open(path, 'rb') as log:
+                data = log.read()
+                backup.write(data if data.endswith(b'\n') else data + b'\n')
+                backup.flush()
+                os.fsync(backup.fileno())
+            os.remove(path)
+        if backup_path is not None:
+            print ('[Warning] Logged changes that are not replayed are kept in {}'.format(backup_path))
+
+    def rotate(self):
+        '''
+        Moves logged records to the rotated log, called right before a snapshot is taken
+        '''
+        self.flush()
+        self._file.close()
+        if os.path.exists(self.old_path):
+            # The previous snapshot wasn't saved, so keep its records in front of the current ones:
+            with open(self.old_path, 'ab+') as old, open(self.path, 'rb') as cur:
+                old.seek(0, os.SEEK_END)
+                if old.tell() > 0:
+                    old.seek(-1, os.SEEK_END)
+                    if old.read(1) != b'\n':
+                        old.write(b'\n')                  # terminate a torn record
+                old.write(cur.read())
+                old.flush()
+                os.fsync(old.fileno())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.old_path)
+        self._open_log()
+
+    def retire(self):
+        '''
+        Drops the rotated log after the snapshot with its records is saved
+        '''
+        self._remove(self.old_path)
+
+    @staticmethod
+    def _remove(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def _read_session(log_path, default=None):
+        '''
+        Returns the session of the log (default if the log is missing, empty or written before sessions)
+        '''
+        if not os.path.exists(log_path):
+            return default
+        with open(log_path, 'r') as f:
+            try:
+                record = json.loads(f.readline())
+            except ValueError:
+                return default
+        return record['session'] if record.get('op', None) == 'session' else default
+
+    @staticmethod
+    def replay(event_manager, events_path):
+        '''
+        Applies logged changes (of the unsaved rotated log first) to the loaded events.
+        Logs of another session than the loaded snapshot are skipped (they are backed up by attach())
+        '''
+        path = get_journal_path(events_path)
+        for log_path in (path + '.old', path):
+            if not os.path.exists(log_path):
+                continue
+            # Without a snapshot the events are restored from the log only, so its session is taken:
+            if not os.path.exists(events_path):
+                event_manager.session = EventJournal._read_session(log_path, event_manager.session)
+            if EventJournal._read_session(log_path, event_manager.session) != event_manager.session:
+                print ('[Warning] {} belongs to another events file, it is not replayed'.format(log_path))
+                continue
+            with open(log_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue                             # torn write of a record before a crash
+                    EventJournal._apply(event_manager, record)
+
+    @staticmethod
+    def _apply(event_manager, record):
+        op = record['op']
+        if op == 'session':
+            return
+        if op == 'teams':
+            if event_manager.teams['home_team'] is None:
+                event_manager.set_teams(record['home_team'], record['away_team'])
+            return
+
+        event_id = record['id']
+        event_manager.delete_event(event_id)
+        if op != event_manager.DELETED:
+            event_manager.create_event_from_dict(event_id, record['event'])
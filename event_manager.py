@@ -1,10 +1,19 @@
+import os
 import json
+import uuid
 from event_types import EventTypes
+from event_index import EventIndex
+from event_journal import EventJournal
 
 
 class Event:
+    # No per-instance __dict__, it takes most of the memory of large event sets:
+    __slots__ = ('event_id', 'supertype', 'type', 'start_idx', 'end_idx', 'team_key', 'players', 'enemy_players',
+                 'start_cause', 'end_cause', 'start_zone', 'end_zone', 'type_code')
+
     def __init__(self, event_id, supertype, type, start_idx, end_idx=None, team_key='none',
-                 players=None, enemy_players=None, start_cause=None, end_cause=None, start_zone=None, end_zone=None):
+                 players=None, enemy_players=None, start_cause=None, end_cause=None, start_zone=None, end_zone=None,
+                 type_code=-1):
         assert supertype is not None and type is not None
         assert event_id is not None and start_idx is not None
         self.event_id = event_id
@@ -19,14 +28,24 @@ class Event:
         self.end_cause = end_cause
         self.start_zone = start_zone
         self.end_zone = end_zone
+        self.type_code = type_code               # code of (supertype, type) in EventTypes.compiled
 
 
 class EventManager:
+    # Change notifications:
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+
     def __init__(self, event_types : EventTypes, home_team=None, away_team=None, path=None):
         assert home_team is not None or away_team is not None or path is not None
         self.event_types = event_types
         self.events = {}
+        self._listeners = []
+        self._index = EventIndex()               # event intervals for queries by frame
+        self._event_dicts = {}                   # event_id -> serialized event, dropped on change
         self._event_counter = 1
+        self.session = uuid.uuid4().hex          # written to snapshots and journals, so only logs of a snapshot are replayed
 
         # Load:
         if path is not None:
@@ -40,6 +59,24 @@ class EventManager:
         self.team_name_to_key = {home_team: 'home_team', away_team: 'away_team', 'none': 'none'}
 
 
+    def add_listener(self, listener):
+        '''
+        listener(action, event) is called after an event is created, updated or deleted
+        '''
+        self._listeners.append(listener)
+
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+
+    def _notify(self, action, event):
+        self._event_dicts.pop(event.event_id, None)
+        for listener in self._listeners:
+            listener(action, event)
+
+
     def _issue_event_id(self):
         while self._event_counter in self.events:
             self._event_counter += 1
@@ -67,8 +104,11 @@ class EventManager:
             start_cause=start_cause,
             end_cause=end_cause,
             start_zone=start_zone,
-            end_zone=end_zone
+            end_zone=end_zone,
+            type_code=self.event_types.type_code(supertype, type)
         )
+        self._index.add(event_id, start_idx, end_idx)
+        self._notify(self.CREATED, self.events[event_id])
 
         return self.events[event_id]
 
@@ -82,6 +122,8 @@ class EventManager:
             event.start_idx = start_idx
         if end_idx is not None:
             event.end_idx = end_idx
+        if start_idx is not None or end_idx is not None:
+            self._index.update(event_id, event.start_idx, event.end_idx)
         if team_key is not None:
             event.team_key = team_key
         if players is not None:
@@ -96,6 +138,7 @@ class EventManager:
             event.start_zone = start_zone
         if end_zone is not None:
             event.end_zone = end_zone
+        self._notify(self.UPDATED, event)
 
         return event
 
@@ -110,15 +153,45 @@ class EventManager:
             return False
         else:
             del self.events[event_id]
+            self._index.remove(event_id)
+            self._notify(self.DELETED, event)
             return True
 
 
-    def load(self, path):
-        self.events2 = {}
+    def events_at(self, frame_id):
+        return [self.events[event_id] for event_id in self._index.at(frame_id)]
 
-        # Load:
-        with open(path, 'r') as f:
-            data = json.load(f)
+
+    def events_overlapping(self, start_idx, end_idx):
+        return [self.events[event_id] for event_id in self._index.overlap(start_idx, end_idx)]
+
+
+    def events_in_range(self, start_idx, end_idx):
+        return [self.events[event_id] for event_id in self._index.in_range(start_idx, end_idx)]
+
+
+    def next_event_boundary(self, frame_id):
+        '''
+        Returns the closest frame after frame_id where an event starts or ends (or None)
+        '''
+        boundary = self._index.next_boundary(frame_id)
+        return boundary[0] if boundary is not None else None
+
+
+    def prev_event_boundary(self, frame_id):
+        '''
+        Returns the closest frame before frame_id where an event starts or ends (or None)
+        '''
+        boundary = self._index.prev_boundary(frame_id)
+        return boundary[0] if boundary is not None else None
+
+
+    def load(self, path):
+        # Load snapshot (it may not exist yet if only the journal has been written):
+        data = {'home_team': None, 'away_team': None, 'events': {}}
+        if os.path.exists(path):
+            data = self.read_snapshot(path)
+            self.session = data.get('session', None)             # files saved before sessions have none
 
         if 'event_types_version' in data and data['event_types_version'] != self.event_types.version:
             print ('[Warning] Version mismatch between loaded events and current event_types ({}!={})!'.
@@ -126,56 +199,130 @@ class EventManager:
 
         # Create events:
         for event_id, event in data['events'].items():
-            self.create_event(
-                event_id=int(event_id),
-                supertype=event['supertype'],
-                type=event['type'],
-                start_idx=event['start_frame'],
-                end_idx=event['end_frame'],
-                team_key=event['team_key'],
-                players=event['players'],
-                enemy_players=event['enemy_players'],
-                start_cause=event.get('start_cause', None),
-                end_cause=event.get('end_cause', None),
-                start_zone=event.get('start_zone', None),
-                end_zone=event.get('end_zone', None),
-            )
+            self.create_event_from_dict(int(event_id), event)
 
         # Set team names:
         self._set_teams(data['home_team'], data['away_team'])
 
+        # Replay changes made after the snapshot:
+        EventJournal.replay(self, path)
+        self.validate(warn=True)
 
-    def save(self, path):
+
+    def create_event_from_dict(self, event_id, event):
+        return self.create_event(
+            event_id=event_id,
+            supertype=event['supertype'],
+            type=event['type'],
+            start_idx=event['start_frame'],
+            end_idx=event['end_frame'],
+            team_key=event['team_key'],
+            players=event['players'],
+            enemy_players=event['enemy_players'],
+            start_cause=event.get('start_cause', None),
+            end_cause=event.get('end_cause', None),
+            start_zone=event.get('start_zone', None),
+            end_zone=event.get('end_zone', None),
+        )
+
+
+    def set_teams(self, home_team, away_team):
+        self._set_teams(home_team, away_team)
+
+
+    @staticmethod
+    def event_to_dict(e):
+        event = {
+            'supertype': e.supertype,
+            'type': e.type,
+            'team_key': e.team_key,
+            'start_frame': int(e.start_idx) if e.start_idx is not None else None,
+            'end_frame': int(e.end_idx) if e.end_idx is not None else None,
+            'players': list(e.players) if isinstance(e.players, list) else e.players,
+            'enemy_players': list(e.enemy_players) if isinstance(e.enemy_players, list) else e.enemy_players
+        }
+        # Add optional values:
+        if e.start_cause is not None:
+            event['start_cause'] = e.start_cause
+        if e.end_cause is not None:
+            event['end_cause'] = e.end_cause
+        if e.start_zone is not None:
+            event['start_zone'] = e.start_zone
+        if e.end_zone is not None:
+            event['end_zone'] = e.end_zone
+
+        return event
+
+
+    def to_dict(self):
+        '''
+        Returns a snapshot of events. Serialized events are cached until they change and never modified,
+        so the snapshot is cheap to take and safe to write from another thread
+        '''
         # Create event dictionary:
         event_dict = {}
         for event_id, e in self.events.items():
-            event = {
-                'supertype': e.supertype,
-                'type': e.type,
-                'team_key': e.team_key,
-                'start_frame': int(e.start_idx) if e.start_idx is not None else None,
-                'end_frame': int(e.end_idx) if e.end_idx is not None else None,
-                'players': e.players,
-                'enemy_players': e.enemy_players
-            }
-            # Add optional values:
-            if e.start_cause is not None:
-                event['start_cause'] = e.start_cause
-            if e.end_cause is not None:
-                event['end_cause'] = e.end_cause
-            if e.start_zone is not None:
-                event['start_zone'] = e.start_zone
-            if e.end_zone is not None:
-                event['end_zone'] = e.end_zone
-
+            event = self._event_dicts.get(event_id, None)
+            if event is None:
+                event = self._event_dicts[event_id] = self.event_to_dict(e)
             event_dict[event_id] = event
 
-        # Save:
-        data = {
+        return {
             'home_team': self.teams['home_team'],
             'away_team': self.teams['away_team'],
             'event_types_version': self.event_types.version,
+            'session': self.session,
             'events': event_dict
         }
-        with open(path, 'w') as f:
-            json.dump(data, f, indent=3)
+
+
+    def save(self, path):
+        import event_validator
+        data = self.to_dict()
+        self.write_snapshot(data, path)
+        self.warn_issues(event_validator.validate(data, self.event_types))
+
+
+    def validate(self, warn=False):
+        '''
+        Returns a list of consistency issues of the events (see event_validator)
+        '''
+        import event_validator
+        issues = event_validator.validate(self.to_dict(), self.event_types)
+        if warn:
+            self.warn_issues(issues)
+        return issues
+
+
+    @staticmethod
+    def warn_issues(issues):
+        import event_validator
+        if len(issues) > 0:
+            print ('[Warning] Found {} issues in events:'.format(len(issues)))
+            for line in event_validator.format_issues(issues):
+                print ('   ' + line)
+
+
+    @staticmethod
+    def read_snapshot(path):
+        # Format is detected by content (numpy is only needed for the columnar one):
+        import event_columns
+        if event_columns.is_columnar(path):
+            return event_columns.load(path)
+        with open(path, 'r') as f:
+            return json.load(f)
+
+
+    @staticmethod
+    def write_snapshot(data, path):
+        # Write to a temporary file and replace atomically, so a crash never leaves a truncated file:
+        import event_columns
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb' if path.endswith('.npz') else 'w') as f:
+            if path.endswith('.npz'):
+                event_columns.save(data, f)
+            else:
+                json.dump(data, f, indent=3)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
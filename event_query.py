@@ -0,0 +1,307 @@
+'''
+Loads events of all videos in a directory into one table and answers filter/group-by queries without the GUI.
+
+Usage:
+    python -m event_query --video-dir /path/to/videos --group-by supertype,type
+    python -m event_query --video-dir /path/to/videos --where supertype=ATTACK --group-by match,team --output stats.json
+'''
+import os
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import event_columns
+from event_types import EventTypes
+
+EVENT_FILE_SUFFIXES = ('_events.json', '_events.npz')
+DEFAULT_FPS = 25.0
+
+# Categorical columns of the table (values are stored as codes into EventTable.categories):
+CATEGORY_COLUMNS = ('match', 'supertype', 'type', 'supertype_alias', 'type_alias', 'team_key', 'team',
+                    'start_cause', 'end_cause')
+
+
+def find_event_files(video_dir):
+    '''
+    Returns one events file per match, the most recently saved one if the match has files in several formats
+    '''
+    matches = {}
+    for root, dirs, files in os.walk(video_dir):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]     # e.g. .proxy
+        for name in files:
+            if not name.endswith(EVENT_FILE_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            key = (root, get_match_name(path))
+            if key not in matches or os.path.getmtime(path) > os.path.getmtime(matches[key]):
+                matches[key] = path
+    return sorted(matches.values())
+
+
+def get_match_name(events_path):
+    name = os.path.basename(events_path)
+    for suffix in EVENT_FILE_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def read_video_fps(events_path):
+    '''
+    Returns fps of the video the events belong to (or None if there is no video)
+    '''
+    import cv2
+    match_dir, match_name = os.path.dirname(events_path), get_match_name(events_path)
+    for name in os.listdir(match_dir):
+        stem, ext = os.path.splitext(name)
+        if stem == match_name and ext.lower() in ('.mp4', '.avi', '.mkv', '.mov', '.mts', '.ts'):
+            cap = cv2.VideoCapture(os.path.join(match_dir, name))
+            fps = cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() else 0
+            cap.release()
+            if fps > 0:
+                return fps
+    return None
+
+
+def load_event_file(path, read_fps=True):
+    '''
+    Loads events of one match as columns (runs in a worker process, so only arrays are returned)
+    '''
+    if event_columns.is_columnar(path):
+        columns = event_columns.load_columns(path)
+    else:
+        with open(path, 'r') as f:
+            columns = event_columns.to_columns(json.load(f))
+    columns['fps'] = read_video_fps(path) if read_fps else None
+    return path, columns
+
+
+class EventTable:
+    '''
+    Events of many matches as numpy columns: numeric columns hold frames and seconds,
+    categorical columns hold int32 codes into self.categories[column] (-1 for None)
+    '''
+    def __init__(self, columns, categories, num_matches=0):
+        self.columns = columns
+        self.categories = categories
+        self.num_matches = num_matches           # loaded events files (including ones without events)
+
+    def __len__(self):
+        return len(self.columns['event_id'])
+
+    @staticmethod
+    def from_matches(matches, event_types : EventTypes):
+        '''
+        :param matches: list of (events_path, columns) returned by load_event_file
+        '''
+        categories = {name: [] for name in CATEGORY_COLUMNS}
+        codes = {name: {} for name in CATEGORY_COLUMNS}
+
+        def encode(name, values):
+            table, column_codes = categories[name], codes[name]
+            result = np.empty(len(values), dtype=np.int32)
+            for i, value in enumerate(values):
+                if value is None:
+                    result[i] = -1
+                    continue
+                code = column_codes.get(value, None)
+                if code is None:
+                    code = column_codes[value] = len(table)
+                    table.append(value)
+                result[i] = code
+            return result
+
+        parts = {name: [] for name in ('event_id', 'start_frame', 'end_frame', 'start_s', 'end_s', 'duration_s',
+                                       'num_players', 'num_enemy_players') + CATEGORY_COLUMNS}
+        for path, columns in matches:
+            meta = json.loads(str(columns['meta']))
+            fps = columns['fps'] if columns['fps'] is not None else DEFAULT_FPS
+            if 'event_types_version' in meta and meta['event_types_version'] != event_types.version:
+                print ('[Warning] Version mismatch between events of {} and current event_types ({}!={})!'.
+                       format(path, meta['event_types_version'], event_types.version))
+
+            num_events = len(columns['event_id'])
+            values = {field: event_columns.decode_table(columns[field + '_values'])
+                      for field in ('supertype', 'type', 'team_key', 'start_cause', 'end_cause')}
+            decoded = {field: [values[field][code] if code != -1 else None for code in columns[field].tolist()]
+                       for field in values}
+
+            # Resolve the taxonomy and team names:
+            supertype_aliases, type_aliases = [], []
+            for supertype, type in zip(decoded['supertype'], decoded['type']):
+                stype = event_types.supertypes.get(supertype, None)
+                supertype_aliases.append(stype.alias if stype is not None else supertype)
+                etype = stype.types.get(type, None) if stype is not None else None
+                type_aliases.append(etype.alias if etype is not None else type)
+            teams = {'home_team': meta.get('home_team', None), 'away_team': meta.get('away_team', None)}
+            team_names = [teams.get(team_key, None) for team_key in decoded['team_key']]
+
+            start, end = columns['start_frame'], columns['end_frame']
+            start_s = np.where(start != event_columns.NO_FRAME, start / fps, np.nan)
+            end_s = np.where(end != event_columns.NO_FRAME, end / fps, np.nan)
+
+            # Events ending before their start are kept but don't count as finished in duration stats:
+            duration_s = end_s - start_s
+            negative = duration_s < 0
+            if np.any(negative):
+                print ('[Warning] {} events of {} end before they start, their durations are not counted'.
+                       format(int(np.count_nonzero(negative)), path))
+                duration_s[negative] = np.nan
+
+            parts['event_id'].append(columns['event_id'])
+            parts['start_frame'].append(start)
+            parts['end_frame'].append(end)
+            parts['start_s'].append(start_s)
+            parts['end_s'].append(end_s)
+            parts['duration_s'].append(duration_s)
+            parts['num_players'].append(np.diff(columns['players_offsets']).astype(np.int32))
+            parts['num_enemy_players'].append(np.diff(columns['enemy_players_offsets']).astype(np.int32))
+            parts['match'].append(encode('match', [get_match_name(path)] * num_events))
+            parts['supertype_alias'].append(encode('supertype_alias', supertype_aliases))
+            parts['type_alias'].append(encode('type_alias', type_aliases))
+            parts['team'].append(encode('team', team_names))
+            for field in decoded:
+                parts[field].append(encode(field, decoded[field]))
+
+        columns = {name: np.concatenate(arrays) if len(arrays) > 0 else np.empty(0)
+                   for name, arrays in parts.items()}
+
+        return EventTable(columns, categories, len(matches))
+
+    def column(self, name):
+        '''
+        Returns values of a column (decoded for categorical columns)
+        '''
+        if name in self.categories:
+            table = self.categories[name]
+            return [table[code] if code >= 0 else None for code in self.columns[name].tolist()]
+        return self.columns[name]
+
+    def filter(self, **conditions):
+        '''
+        Returns events whose columns are equal to the given values (or one of them if a list/tuple is given),
+        e.g. table.filter(supertype='ATTACK', team=['Зенит', 'Спартак'])
+        '''
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in conditions.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            if name in self.categories:
+                table = self.categories[name]
+                codes = [table.index(v) for v in values if v in table]
+                mask &= np.isin(self.columns[name], codes)
+            else:
+                mask &= np.isin(self.columns[name], list(values))
+        return self.take(mask)
+
+    def take(self, mask):
+        return EventTable({name: column[mask] for name, column in self.columns.items()}, self.categories,
+                          self.num_matches)
+
+    def group_by(self, *names):
+        '''
+        Returns [(key, stats)], where key is a tuple of decoded values of the given columns
+        and stats has count and duration statistics (in seconds, unfinished events and ones ending
+        before their start are not counted)
+        '''
+        if len(self) == 0:
+            return []
+        keys = np.stack([self.columns[name].astype(np.int64) for name in names], axis=1) if len(names) > 0 \
+            else np.zeros((len(self), 1), dtype=np.int64)
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        counts = np.bincount(inverse, minlength=len(unique_keys))
+        durations = self.columns['duration_s']
+        finished = ~np.isnan(durations)
+        num_finished = np.bincount(inverse[finished], minlength=len(unique_keys))
+        total = np.bincount(inverse[finished], weights=durations[finished], minlength=len(unique_keys))
+
+        groups = []
+        for i, key in enumerate(unique_keys.tolist()):
+            decoded = tuple(self._decode(name, value) for name, value in zip(names, key))
+            groups.append((decoded, {
+                'count': int(counts[i]),
+                'finished': int(num_finished[i]),
+                'duration_total_s': float(total[i]),
+                'duration_mean_s': float(total[i] / num_finished[i]) if num_finished[i] > 0 else None
+            }))
+        return groups
+
+    def _decode(self, name, value):
+        if name in self.categories:
+            return self.categories[name][value] if value >= 0 else None
+        return value
+
+
+def load_table(video_dir, event_types : EventTypes, workers=None, read_fps=True):
+    paths = find_event_files(video_dir)
+    if len(paths) == 0:
+        return EventTable.from_matches([], event_types)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        matches = list(executor.map(load_event_file, paths, [read_fps] * len(paths)))
+
+    return EventTable.from_matches(matches, event_types)
+
+
+def parse_conditions(conditions):
+    '''
+    Parses ['name=value1,value2', ...] to {name: [values]} (values of numeric columns are converted to int)
+    '''
+    result = {}
+    for condition in conditions:
+        name, value = condition.split('=', 1)
+        values = value.split(',')
+        if name not in CATEGORY_COLUMNS:
+            values = [int(v) for v in values]
+        result[name] = values
+    return result
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Cross-match queries over events of all videos in a directory')
+    parser.add_argument('--video-dir', required=True, help='path to dir containing videos and their events')
+    parser.add_argument('--types-path', default='./assets/event_types.json')
+    parser.add_argument('--where', action='append', default=[],
+                        help='filter as COLUMN=VALUE[,VALUE...], can be repeated (columns: {})'.format(
+                            ', '.join(CATEGORY_COLUMNS)))
+    parser.add_argument('--group-by', default='supertype_alias,type_alias', help='comma-separated columns')
+    parser.add_argument('--workers', type=int, default=None, help='number of loader processes')
+    parser.add_argument('--no-video-fps', action='store_true', default=False,
+                        help='do not read fps of videos, durations are computed at {} fps'.format(DEFAULT_FPS))
+    parser.add_argument('--output', default=None, help='save results to a json file')
+
+    args = parser.parse_args()
+    if not os.path.isdir(args.video_dir):
+        parser.error('--video-dir {} does not exist'.format(args.video_dir))
+
+    return args
+
+
+def main():
+    args = get_args()
+    event_types = EventTypes(args.types_path)
+    table = load_table(args.video_dir, event_types, args.workers, read_fps=not args.no_video_fps)
+    print ('Loaded {} events of {} matches'.format(len(table), table.num_matches))
+
+    table = table.filter(**parse_conditions(args.where))
+    names = [name for name in args.group_by.split(',') if len(name) > 0]
+    groups = table.group_by(*names)
+
+    for key, stats in groups:
+        mean = '{:.1f}'.format(stats['duration_mean_s']) if stats['duration_mean_s'] is not None else '-'
+        print ('{}: count {}, mean duration {} s, total {:.1f} s'.format(
+            ' / '.join(str(k) for k in key), stats['count'], mean, stats['duration_total_s']))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump([{'key': dict(zip(names, key)), **stats} for key, stats in groups], f,
+                      indent=3, ensure_ascii=False)
+        print ('Results are saved to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -1,4 +1,7 @@
+import os
 import json
+import pickle
+import hashlib
 
 
 class EventSupertype:
@@ -18,15 +21,83 @@ class EventSubtype:
         self.end_causes = end_causes
 
 
+class CompiledEventTypes:
+    '''
+    Flat tables of the taxonomy: types get integer codes (in the order of the json file),
+    display labels are precomputed per code, so lookups are list indexing
+    '''
+    UNKNOWN = -1
+
+    def __init__(self, supertypes):
+        self.type_codes = {}                     # (supertype, type) -> code
+        self.labels = []                         # type code -> 'supertype alias - type alias'
+
+        for stype_name, stype in supertypes.items():
+            for type_name, type in stype.types.items():
+                self.type_codes[(stype_name, type_name)] = len(self.labels)
+                self.labels.append('{} - {}'.format(stype.alias, type.alias))
+
+    def type_code(self, supertype, type):
+        return self.type_codes.get((supertype, type), self.UNKNOWN)
+
+    def label(self, type_code):
+        return self.labels[type_code] if type_code != self.UNKNOWN else '?'
+
+
 class EventTypes:
-    def __init__(self, types_path='./assets/event_types.json'):
-        self.supertypes, self.version = self.open(types_path)
+    # Bump to invalidate caches written by older code:
+    CACHE_VERSION = 2
+
+    def __init__(self, types_path='./assets/event_types.json', cache_path=None):
+        if cache_path is None:
+            cache_path = os.path.splitext(types_path)[0] + '.cache'
+        self.supertypes, self.version, self.compiled = self.load(types_path, cache_path)
+
+    def type_code(self, supertype, type):
+        return self.compiled.type_code(supertype, type)
+
+    @staticmethod
+    def load(types_path, cache_path):
+        '''
+        Returns (supertypes, version, compiled) from the cache if it was built from the same json
+        '''
+        with open(types_path, 'rb') as f:
+            raw = f.read()
+        key = '{}:{}'.format(EventTypes.CACHE_VERSION, hashlib.sha1(raw).hexdigest())
+
+        try:
+            with open(cache_path, 'rb') as f:
+                cache = pickle.load(f)
+            if cache['key'] == key:
+                return cache['supertypes'], cache['version'], cache['compiled']
+        except Exception:
+            # A missing, truncated or stale cache (e.g. pickled by older code) is rebuilt:
+            pass
+
+        supertypes, version = EventTypes.parse(json.loads(raw.decode('utf8')))
+        compiled = CompiledEventTypes(supertypes)
+
+        # The cache is optional (e.g. assets may be read-only in a bundled app):
+        try:
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'key': key, 'supertypes': supertypes, 'version': version, 'compiled': compiled}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+        return supertypes, version, compiled
 
     @staticmethod
     def open(path):
         with open(path, 'r', encoding="utf8") as f:
             data = json.load(f)
 
+        return EventTypes.parse(data)
+
+    @staticmethod
+    def parse(data):
         supertypes = {}
         for stype_name, stype in data['supertypes'].items():
             supertypes[stype_name] = EventSupertype(supertype=stype_name, alias=stype['alias'])
@@ -40,4 +111,4 @@ class EventTypes:
                     end_causes=type['end_causes']
                 )
 
-        return supertypes, data['version']
\ No newline at end of file
+        return supertypes, data['version']
@@ -0,0 +1,185 @@
+'''
+Consistency checks of events, vectorized over the columns of event_columns.
+
+Usage:
+    python -m event_validator --video-dir /path/to/videos
+'''
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import event_columns
+from event_types import EventTypes
+
+NO_VALUE = event_columns.NO_VALUE
+NO_FRAME = event_columns.NO_FRAME
+
+# Checks:
+NEGATIVE_FRAME = 'negative_frame'
+END_BEFORE_START = 'end_before_start'
+MISSING_END = 'missing_end'
+OVERLAPPING_ATTACK = 'overlapping_attack'
+UNKNOWN_TYPE = 'unknown_type'
+UNKNOWN_START_CAUSE = 'unknown_start_cause'
+UNKNOWN_END_CAUSE = 'unknown_end_cause'
+
+OVERLAP_SUPERTYPE = 'ATTACK'
+
+
+def issue(event_id, check, message):
+    return {'event_id': int(event_id), 'check': check, 'message': message}
+
+
+def validate(data, event_types : EventTypes):
+    '''
+    Checks events of EventManager.to_dict(), returns a list of issues sorted by event id
+    '''
+    return validate_columns(event_columns.to_columns(data), event_types)
+
+
+def validate_columns(columns, event_types : EventTypes):
+    event_ids = columns['event_id']
+    start, end = columns['start_frame'], columns['end_frame']
+    issues = []
+
+    # Frames (e.g. an event created before the first frame is shown starts at -1):
+    for name, frames in (('start', start), ('end', end)):
+        for i in np.flatnonzero((frames != NO_FRAME) & (frames < 0)):
+            issues.append(issue(event_ids[i], NEGATIVE_FRAME, '{} frame {} is negative'.format(name, frames[i])))
+    for i in np.flatnonzero((end != NO_FRAME) & (start != NO_FRAME) & (end < start)):
+        issues.append(issue(event_ids[i], END_BEFORE_START,
+                            'end frame {} is before start frame {}'.format(end[i], start[i])))
+    for i in np.flatnonzero(end == NO_FRAME):
+        issues.append(issue(event_ids[i], MISSING_END, 'event has no end frame'))
+
+    issues.extend(check_taxonomy(columns, event_types))
+    issues.extend(check_overlaps(columns, OVERLAP_SUPERTYPE))
+    issues.sort(key=lambda x: x['event_id'])
+
+    return issues
+
+
+def check_taxonomy(columns, event_types : EventTypes):
+    '''
+    Each distinct (supertype, type, cause) combination is checked once and the result is broadcast to events
+    '''
+    issues = []
+    supertypes = event_columns.decode_table(columns['supertype_values'])
+    types = event_columns.decode_table(columns['type_values'])
+    event_ids = columns['event_id']
+    if len(event_ids) == 0:
+        return issues
+
+    for field, check, attr in [(None, UNKNOWN_TYPE, None),
+                               ('start_cause', UNKNOWN_START_CAUSE, 'start_causes'),
+                               ('end_cause', UNKNOWN_END_CAUSE, 'end_causes')]:
+        keys = [columns['supertype'], columns['type']] + ([columns[field]] if field is not None else [])
+        combinations, inverse = np.unique(np.stack(keys, axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        causes = event_columns.decode_table(columns[field + '_values']) if field is not None else None
+
+        invalid = np.zeros(len(combinations), dtype=bool)
+        messages = [None] * len(combinations)
+        for k, combination in enumerate(combinations.tolist()):
+            stype = event_types.supertypes.get(supertypes[combination[0]], None)
+            etype = stype.types.get(types[combination[1]], None) if stype is not None else None
+            if field is None:
+                if etype is None:
+                    invalid[k] = True
+                    messages[k] = 'type {}.{} is not in event types'.format(
+                        supertypes[combination[0]], types[combination[1]])
+            elif etype is not None and combination[2] != NO_VALUE:
+                cause = causes[combination[2]]
+                known = getattr(etype, attr)
+                if cause is not None and (known is None or str(cause) not in known):
+                    invalid[k] = True
+                    messages[k] = '{} {} is not in {} of {}.{}'.format(
+                        field, cause, attr, etype.supertype, etype.type)
+
+        for i in np.flatnonzero(invalid[inverse]):
+            issues.append(issue(event_ids[i], check, messages[inverse[i]]))
+
+    return issues
+
+
+def check_overlaps(columns, supertype):
+    '''
+    Finds events of the supertype starting before an earlier event of the same team ends
+    '''
+    supertypes = event_columns.decode_table(columns['supertype_values'])
+    if supertype not in supertypes:
+        return []
+    # Events with negative (or no) start frames are reported by other checks:
+    selected = np.flatnonzero((columns['supertype'] == supertypes.index(supertype)) & (columns['start_frame'] >= 0))
+    if len(selected) < 2:
+        return []
+
+    team = columns['team_key'][selected].astype(np.int64) + 1
+    start = columns['start_frame'][selected].astype(np.int64)
+    end = columns['end_frame'][selected].astype(np.int64)
+    end = np.where(end == NO_FRAME, start, np.maximum(end, start))       # unfinished events are points
+
+    # Sort by team and start, shift each team to its own frame range, so one running maximum serves all teams:
+    order = np.lexsort((start, team))
+    span = int(end.max()) + 1
+    start, end = start[order] + team[order] * span, end[order] + team[order] * span
+
+    # Running max of the end frames of previous events (with the position of the event it comes from):
+    n = len(order)
+    keys = np.maximum.accumulate(end * n + np.arange(n))
+    prev_end, prev_pos = keys[:-1] // n, keys[:-1] % n
+    overlaps = np.flatnonzero(start[1:] < prev_end)
+
+    event_ids = columns['event_id'][selected][order]
+    return [issue(event_ids[i+1], OVERLAPPING_ATTACK,
+                  '{} overlaps event {} of the same team'.format(supertype, event_ids[prev_pos[i]]))
+            for i in overlaps]
+
+
+def format_issues(issues):
+    return ['event {}: {}'.format(x['event_id'], x['message']) for x in issues]
+
+
+def validate_file(path, types_path):
+    from event_query import load_event_file
+    _, columns = load_event_file(path, read_fps=False)
+    return path, validate_columns(columns, EventTypes(types_path))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Consistency checks of events of all videos in a directory')
+    parser.add_argument('--video-dir', required=True, help='path to dir containing videos and their events')
+    parser.add_argument('--types-path', default='./assets/event_types.json')
+    parser.add_argument('--skip', default=MISSING_END, help='comma-separated checks to skip')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--output', default=None, help='save issues to a json file')
+
+    return parser.parse_args()
+
+
+def main():
+    from event_query import find_event_files
+    args = get_args()
+    skip = set(args.skip.split(','))
+    paths = find_event_files(args.video_dir)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for path, issues in executor.map(validate_file, paths, [args.types_path] * len(paths)):
+            issues = [x for x in issues if x['check'] not in skip]
+            results[path] = issues
+            print ('{}: {} issues'.format(path, len(issues)))
+            for line in format_issues(issues):
+                print ('   ' + line)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=3, ensure_ascii=False)
+        print ('Results are saved to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
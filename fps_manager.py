@@ -1,68 +1,84 @@
-from datetime import datetime
+import math
+import time
+from collections import deque
 
 
 class FPSManager:
-    def __init__(self, target_fps=30):
+    '''
+    Measures presented frames on a monotonic nanosecond clock (real FPS and interval statistics).
+    Frames are paced by FrameScheduler against the playback anchor of VideoPlayer, so errors don't accumulate.
+    The clock is injectable for testing
+    '''
+    def __init__(self, clock=time.perf_counter_ns, window=256):
+        self._clock = clock
+        self._intervals = deque(maxlen=window)       # last frame intervals in ns
         self.reset()
-        self.set_target_fps(target_fps)
 
     def reset(self):
-        self._delay = 0
-        self.prev_time = datetime.now()
-        self.start_time = datetime.now()
+        self.prev_time = self._clock()
         self.tic = 0
         self.real_fps = 0.0
-
-    def set_target_fps(self, target_fps):
-        self.target_fps = target_fps
-        target_frame_delta = 1.0 / self.target_fps
-        self._delay = int(round(target_frame_delta * 1000))
-        self.tic = 0
-        self.start_time = datetime.now()
-
-    def calulate_delay(self):
-        target_frame_delta = 1.0 / self.target_fps
-        new_time = datetime.now()
-        frame_delta = (new_time - self.prev_time).total_seconds()
-        self.prev_time = new_time
-        if frame_delta < target_frame_delta:
-            self._delay += 1
-        elif frame_delta > target_frame_delta:
-            self._delay = self._delay - 1 if self._delay > 0 else 0
-
-        return self._delay
+        self._intervals.clear()
 
     def mesure_fps(self):
+        '''
+        Registers a presented frame and returns the real FPS over the last frames
+        '''
+        new_time = self._clock()
+        if self.tic > 0:
+            self._intervals.append(new_time - self.prev_time)
+        self.prev_time = new_time
         self.tic += 1
-        if self.tic >= self.target_fps:
-            self.tic = 0
-            stop_time = datetime.now()
-            elapsed = (stop_time - self.start_time).total_seconds()
-            self.start_time = stop_time
-            self.real_fps = 1.0/(elapsed/self.target_fps)
+
+        if len(self._intervals) > 0:
+            mean = sum(self._intervals) / len(self._intervals)
+            self.real_fps = 1e9 / mean if mean > 0 else 0.0
 
         return self.real_fps
-#
-#
-#
-#
-#
-#
-#
-#
-# import PySimpleGUI as sg
-# #set the theme for the screen/window
-# sg.theme('SystemDefault')
-# menu_def=['&File', ['&New File', '&Open...','Open &Module','---', '!&Recent Files','C&lose']],['&Save',['&Save File', 'Save &As','Save &Copy'  ]],['&Edit', ['&Cut', '&Copy', '&Paste']]
-# #define layout
-# layout=[[sg.Menu(menu_def, background_color='lightsteelblue',text_color='navy', disabled_text_color='yellow', font='Verdana', pad=(10,10))],
-#         [sg.ButtonMenu('', [['nf', 'op','om','---','rf','cl'],['New File', 'Open','Open Module','---','Recent Files','Close']],image_filename ='icon_biggrin.gif',border_width=5),sg.ButtonMenu('', [['rm', 'rc','sm','ps'],['Run', 'Run Module','Shell','Python module']],image_filename ='icon_cry.gif',background_color='teal'),sg.ButtonMenu('Terminate', [['ex', 'cl','---','ab'],['Exit', 'Close','---','About us...']])],
-#         [sg.Multiline(size=(80,10),tooltip='Write your Text here')],
-#         [sg.Text('File Name'),sg.Input(),sg.OptionMenu(values=['.txt','.pdf','.gif', '.jpg','.mp4','.gif','.dat','.sql'],size=(4,8),default_value='.doc',key='ftype')],
-#         [sg.Button('SAVE', font=('Times New Roman',12)),sg.Button('CANCEL', font=('Times New Roman',12))]]
-# #Define Window
-# win =sg.Window('Your Custom Editor',layout)
-# #Read  values entered by user
-# events,values=win.read()
-# #close first window
-# win.close()
+
+    def stats(self):
+        '''
+        Returns frame interval statistics in milliseconds
+        '''
+        if len(self._intervals) == 0:
+            return None
+
+        intervals = sorted(self._intervals)
+        n = len(intervals)
+        mean = sum(intervals) / n
+        jitter = math.sqrt(sum((x - mean) ** 2 for x in intervals) / n)
+
+        def percentile(p):
+            return intervals[min(n - 1, int(round(p / 100.0 * (n - 1))))] / 1e6
+
+        return {
+            'fps': self.real_fps,
+            'mean_ms': mean / 1e6,
+            'jitter_ms': jitter / 1e6,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'p99_ms': percentile(99),
+            'max_ms': intervals[-1] / 1e6
+        }
+
+
+class FrameScheduler:
+    '''
+    Event-driven pacing of the GUI loop: window.read() sleeps exactly until the next frame
+    has to be presented and blocks indefinitely while nothing is playing
+    '''
+    def __init__(self, poll_ms=2):
+        self._poll_ms = poll_ms
+
+    def timeout(self, player, playing, waiting):
+        '''
+        :param playing: frames are being played (including a single frame after rewinding)
+        :param waiting: the due frame has not been decoded yet
+        :return:        timeout for window.read() in milliseconds (None blocks until a window event)
+        '''
+        if not playing or not player.is_open():
+            return None
+        if waiting:
+            return self._poll_ms
+
+        return int(math.ceil(player.next_frame_delay() * 1000))
@@ -0,0 +1,71 @@
+import bisect
+
+
+class FrameCache:
+    '''
+    Memory-budgeted cache of decoded and resized frames around the playhead.
+    When the budget is exceeded, the frames farthest from the playhead are evicted first
+    '''
+    def __init__(self, max_bytes=256*1024*1024):
+        self._max_bytes = max_bytes
+        self._frames = {}
+        self._ids = []                           # sorted ids of cached frames
+        self._size = None                        # width, height of cached frames
+        self._nbytes = 0
+
+    def clear(self):
+        self._frames = {}
+        self._ids = []
+        self._size = None
+        self._nbytes = 0
+
+    def put(self, frame_id, frame, playhead):
+        if frame.nbytes > self._max_bytes:
+            return
+
+        # Frames of another resolution can't be shown anymore:
+        size = (frame.shape[1], frame.shape[0])
+        if size != self._size:
+            self.clear()
+            self._size = size
+
+        if frame_id in self._frames:
+            return
+
+        # Frame can be a view of the shared buffer, so it has to be copied:
+        self._frames[frame_id] = frame.copy()
+        bisect.insort(self._ids, frame_id)
+        self._nbytes += frame.nbytes
+
+        # Evict the farthest frames from the playhead:
+        while self._nbytes > self._max_bytes:
+            if abs(self._ids[0] - playhead) >= abs(self._ids[-1] - playhead):
+                evicted_id = self._ids.pop(0)
+            else:
+                evicted_id = self._ids.pop()
+            self._nbytes -= self._frames.pop(evicted_id).nbytes
+
+    def get(self, frame_id, size):
+        if size != self._size:
+            return None
+        return self._frames.get(frame_id, None)
+
+    def contiguous_end(self, frame_id, size):
+        '''
+        Returns the first frame id at or after frame_id that is not in the cache
+        '''
+        if size != self._size:
+            return frame_id
+
+        i = bisect.bisect_left(self._ids, frame_id)
+        while i < len(self._ids) and self._ids[i] == frame_id:
+            frame_id += 1
+            i += 1
+        return frame_id
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._ids)
@@ -0,0 +1,127 @@
+import os
+import json
+import bisect
+from pathlib import Path
+
+
+def get_keyframe_index_path(video_path):
+    p = Path(video_path)
+    video_dir = p.parent.absolute()
+    video_name = p.stem
+
+    return os.path.join(video_dir, video_name + '_keyframes.json')
+
+
+class KeyframeIndex:
+    '''
+    Sorted list of keyframe (GOP start) ids of a video used for fast seeking
+    '''
+    def __init__(self, keyframes, num_frames):
+        assert len(keyframes) > 0
+        self.keyframes = keyframes
+        self.num_frames = num_frames
+
+    def nearest(self, frame_id):
+        '''
+        Returns the closest keyframe at or before frame_id
+        '''
+        i = bisect.bisect_right(self.keyframes, frame_id) - 1
+        return self.keyframes[i] if i >= 0 else self.keyframes[0]
+
+    def save(self, path, video_path):
+        stat = os.stat(video_path)
+        data = {
+            'video_size': stat.st_size,
+            'video_mtime': int(stat.st_mtime),
+            'num_frames': self.num_frames,
+            'keyframes': self.keyframes
+        }
+        # Write to a temporary file first so that a reader never sees a partial index:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path, video_path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # The index is stale if the video has been replaced:
+        stat = os.stat(video_path)
+        if data['video_size'] != stat.st_size or data['video_mtime'] != int(stat.st_mtime):
+            return None
+        if len(data['keyframes']) == 0:
+            return None
+
+        return KeyframeIndex(data['keyframes'], data['num_frames'])
+
+    @staticmethod
+    def build(video_path):
+        '''
+        Scans the video without decoding (raw packets only) and collects keyframe ids
+        '''
+        import cv2
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return None
+
+        # Raw stream mode is required to get keyframe flags from the backend:
+        if not cap.set(cv2.CAP_PROP_FORMAT, -1):
+            cap.release()
+            return None
+
+        keyframes = []
+        frame_id = 0
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(frame_id)
+            frame_id += 1
+        cap.release()
+
+        if len(keyframes) == 0 or keyframes[0] != 0:
+            return None                                     # backend does not report keyframes
+
+        return KeyframeIndex(keyframes, frame_id)
+
+    @staticmethod
+    def run_builder(video_path, index_path):
+        '''
+        Runs worker to build the keyframe index and cache it on disk
+        '''
+        index = KeyframeIndex.build(video_path)
+        if index is not None:
+            index.save(index_path, video_path)
+
+
+def seek(cap, pos, target_frame_id, index=None, cancelled=None):
+    '''
+    Moves capture to target_frame_id and returns the new position.
+    pos is the id of the next frame the capture will return.
+    Decoding forward stops early if cancelled() returns True (e.g. a newer seek is requested)
+    '''
+    import cv2
+    if index is None:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, target_frame_id)
+        return target_frame_id
+
+    # Seek to the nearest keyframe unless the target is reachable by decoding forward within the current GOP:
+    keyframe = index.nearest(target_frame_id)
+    if not (keyframe <= pos <= target_frame_id):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        pos = keyframe
+
+    # Decode forward only the needed frames:
+    while pos < target_frame_id:
+        if cancelled is not None and cancelled():
+            break
+        if not cap.grab():
+            break
+        pos += 1
+
+    return pos
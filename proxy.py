@@ -0,0 +1,115 @@
+import os
+import glob
+import hashlib
+from pathlib import Path
+from multiprocessing import Process
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+
+
+def video_hash(path, chunk_size=1024*1024):
+    '''
+    Fast content hash of a video: file size plus its first, middle and last chunks
+    '''
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        for offset in (0, max(0, size // 2 - chunk_size // 2), max(0, size - chunk_size)):
+            f.seek(offset)
+            h.update(f.read(chunk_size))
+
+    return h.hexdigest()[:16]
+
+
+class ProxyManager:
+    '''
+    Transcodes videos into low-resolution all-intra (MJPEG) proxies cached on disk.
+    Every source frame is written to the proxy, so frame ids of the proxy and the source are identical
+    '''
+    def __init__(self, proxy_dir, height=540):
+        self.proxy_dir = proxy_dir
+        self.height = height
+        self._hashes = {}
+        self._builder = None
+
+    def get_proxy_path(self, video_path):
+        if video_path not in self._hashes:
+            self._hashes[video_path] = video_hash(video_path)
+        name = '{}_{}_{}p.avi'.format(Path(video_path).stem, self._hashes[video_path], self.height)
+
+        return os.path.join(self.proxy_dir, name)
+
+    def find_proxy(self, video_path):
+        proxy_path = self.get_proxy_path(video_path)
+        return proxy_path if os.path.exists(proxy_path) else None
+
+    def start(self, video_dir):
+        '''
+        Transcodes all videos of video_dir in the background
+        '''
+        video_paths = []
+        for ext in VIDEO_EXTENSIONS:
+            video_paths.extend(glob.glob(os.path.join(video_dir, '*' + ext)))
+        video_paths = [p for p in sorted(video_paths) if self.find_proxy(p) is None]
+        if len(video_paths) == 0:
+            return
+
+        proxy_paths = [self.get_proxy_path(p) for p in video_paths]
+        self._builder = Process(target=ProxyManager.run_builder, args=(video_paths, proxy_paths, self.height), daemon=True)
+        self._builder.start()
+
+    @staticmethod
+    def run_builder(video_paths, proxy_paths, height):
+        '''
+        Runs worker to transcode proxies one by one
+        '''
+        for video_path, proxy_path in zip(video_paths, proxy_paths):
+            if not os.path.exists(proxy_path):
+                if not ProxyManager.transcode(video_path, proxy_path, height):
+                    print ('[Warning] Failed to create proxy for {}'.format(video_path))
+
+    @staticmethod
+    def transcode(video_path, proxy_path, height):
+        import cv2
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return False
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        src_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if src_height <= height:
+            height = src_height
+        size = (int(round(width * height / src_height / 2)) * 2, height)
+
+        # Write to a temporary file first so that a partial proxy is never played:
+        os.makedirs(os.path.dirname(proxy_path), exist_ok=True)
+        tmp_path = proxy_path[:-len('.avi')] + '.tmp.avi'
+        writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+        if not writer.isOpened():
+            cap.release()
+            return False
+
+        num_frames = 0
+        while True:
+            _, frame = cap.read()
+            if frame is None:
+                break
+            if frame.shape[1] != size[0] or frame.shape[0] != size[1]:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            writer.write(frame)
+            num_frames += 1
+        writer.release()
+        cap.release()
+
+        # Frame ids must match the source, otherwise event frame indices would be shifted:
+        check = cv2.VideoCapture(tmp_path)
+        proxy_num_frames = int(check.get(cv2.CAP_PROP_FRAME_COUNT))
+        check.release()
+        if num_frames == 0 or proxy_num_frames != num_frames:
+            os.remove(tmp_path)
+            return False
+
+        os.replace(tmp_path, proxy_path)
+
+        return True
@@ -1,18 +1,24 @@
+from startup import StartupProfiler, preload     # first, so startup timings count all imports
 import os
+import time
 import argparse
 import datetime
 import multiprocessing
 from pathlib import Path
 from enum import Enum
-import numpy as np
 import PySimpleGUI as sg
 
-from video_player import VideoPlayer, disable_opencv_multithreading
-from fps_manager import FPSManager
+from fps_manager import FPSManager, FrameScheduler
 from event_types import EventTypes
 from event_manager import EventManager
+from event_journal import EventJournal, get_journal_path
+from autosave import AutosaveService
 from windows.main import WindowMain, show_team_setting_window, SPEED_VALUES
-from windows.utils import image_np_to_pil, show_conformation_window
+from windows.utils import FrameDisplay, show_conformation_window
+
+
+SLIDER_SEEK_DELAY = 0.15          # seconds after the slider stops moving to seek
+EVENTS_FORMATS = ('json', 'npz')
 
 
 class State(Enum):
@@ -41,52 +47,135 @@ def calculate_frame_size(window_size, target_frame_size=(1280,720), max_frame_si
     return frame_size
 
 
-def get_events_path(video_path):
+def get_events_path(video_path, events_format='json'):
     p = Path(video_path)
     game_dir = p.parent.absolute()
     game_name = p.stem
 
-    return os.path.join(game_dir, game_name + '_events.json')
+    return os.path.join(game_dir, game_name + '_events.' + events_format)
+
+
+def find_events_path(video_path):
+    '''
+    Returns the most recently saved events file of the video in any format (None if there is no one)
+    '''
+    found = []
+    for events_format in EVENTS_FORMATS:
+        path = get_events_path(video_path, events_format)
+        if os.path.exists(path):
+            found.append((os.path.getmtime(path), path))
+
+    return max(found)[1] if len(found) else None
+
+
+def run_player(video_dir, cache_mb=256, proxy_height=None, decode_workers=1, autosave_interval=30.0, autosave_edits=20,
+               events_format='json', enable_cvmp=False, profile_startup=False, thumbnail_interval=2.0, buffer_mb=64,
+               frame_cache_mb=0):
+    profiler = StartupProfiler(enabled=profile_startup)
+    profiler.mark('imports')
 
+    # Heavy modules are loaded in the background while the window is built:
+    preloading = preload(['numpy', 'video_player', 'proxy', 'cv2', 'event_columns', 'event_validator'], profiler)
 
-def run_player(video_dir):
     # Instantiate:
-    player = VideoPlayer(5)
     fps_manager = FPSManager()
+    frame_scheduler = FrameScheduler()
     event_types = EventTypes()
+    profiler.mark('event types')
     event_manager = None
+    event_journal = None
+    autosave = None
+    shown_saves = 0
     state = State.NOT_OPEN
 
-    # Create GUI windows:
+    # Create GUI windows (event panels are built when the first video is opened):
     window_main = WindowMain(event_types, video_dir)
     window_main.set_event_layout_visibility(False)
-    pil_img = image_np_to_pil(np.zeros((360, 640, 3), dtype=np.uint8))
+    frame_display = FrameDisplay(window_main.window['image_canvas'])
+    frame_display.clear(640, 360)
+    window_main.window.refresh()
+    profiler.mark('window shown')
+
+    # Waits for numpy only, OpenCV is imported on the first use (with multithreading disabled by import_cv2):
+    from video_player import VideoPlayer
+    from proxy import ProxyManager
+    from disk_frame_cache import get_frame_cache_dir
+
+    # Transcode low-resolution proxies in the background:
+    proxy_manager = None
+    if proxy_height is not None and video_dir is not None:
+        proxy_manager = ProxyManager(os.path.join(video_dir, '.proxy'), proxy_height)
+        preloading.join()                    # a process forked during an import may hang on the import lock
+        proxy_manager.start(video_dir)
+
+    # Decoded frames are cached on disk for repeated review of the same segments:
+    frame_cache_dir = get_frame_cache_dir(video_dir) if video_dir is not None else None
+    player = VideoPlayer(buffer_bytes=buffer_mb*1024*1024, cache_bytes=cache_mb*1024*1024, proxy_manager=proxy_manager,
+                         num_workers=decode_workers, thumbnail_interval=thumbnail_interval,
+                         disk_cache_dir=frame_cache_dir, disk_cache_bytes=frame_cache_mb*1024*1024)
+    profiler.mark('player')
+    profiler.report()
 
     rewinding = False
     slider_frame_id = 0
+    slider_seek_time = None                  # when the slider was moved last (the seek is pending)
 
     # Playing loop:
     while state != State.EXIT:
-        real_fps, delay = 0, 0
-        if state == State.PLAY:
-            real_fps = fps_manager.mesure_fps()
-            delay = fps_manager.calulate_delay()
-            delay = 0
-
-        # Read next frame:
-        if state == State.PLAY or state == State.PLAY_ONCE:
-            pil_img, state, rewinding, slider_frame_id = \
-                read_next_frame(window_main, player, state, rewinding, slider_frame_id)
-
-        # Update image on the screen:
-        if pil_img is not None:
-            window_main.window['image_canvas'].update(data=pil_img)
+        # Read next frame (not while the slider is being dragged):
+        waiting = False
+        if (state == State.PLAY or state == State.PLAY_ONCE) and slider_seek_time is None:
+            state, rewinding, slider_frame_id, shown = \
+                read_next_frame(window_main, player, frame_display, state, rewinding, slider_frame_id)
+            waiting = not shown and (state == State.PLAY_ONCE or player.next_frame_delay() == 0)
+            if shown:
+                window_main.show_active_events(event_manager, player.frame_id)
+
+            # Count FPS:
+            if shown and state == State.PLAY:
+                real_fps = fps_manager.mesure_fps()
+                if player.frame_id % player.video_fps == 0:
+                    dropped, late = player.playback_stats()
+                    stats = fps_manager.stats()
+                    jitter, p95 = (stats['jitter_ms'], stats['p95_ms']) if stats is not None else (0.0, 0.0)
+                    window_main.window['text_fps'].update(
+                        value='FPS: {:.1f}  Jitter: {:.1f} ms  p95: {:.1f} ms  Draw: {:.1f} ms  Dropped: {}  Late: {}'.format(
+                            real_fps, jitter, p95, frame_display.mean_ms + player.cache_mean_ms, dropped, late)
+                    )
+
+        # Sleep until the next frame is due or a window event arrives (blocks while paused):
+        playing = state == State.PLAY or state == State.PLAY_ONCE
+        timeout = frame_scheduler.timeout(player, playing, waiting)
+        if autosave is not None and autosave.next_save_delay() is not None:
+            timeout = autosave.next_save_delay() if timeout is None else min(timeout, autosave.next_save_delay())
+        if event_journal is not None and event_journal.next_sync_delay() is not None:
+            timeout = event_journal.next_sync_delay() if timeout is None else \
+                min(timeout, event_journal.next_sync_delay())
+        if slider_seek_time is not None:
+            seek_delay = max(0, int((slider_seek_time + SLIDER_SEEK_DELAY - time.perf_counter()) * 1000))
+            timeout = seek_delay if timeout is None else min(timeout, seek_delay)
+        event, values = window_main.window.read(timeout=timeout, timeout_key=None)
+
+        # Seek once the slider stops moving:
+        if slider_seek_time is not None and time.perf_counter() - slider_seek_time >= SLIDER_SEEK_DELAY:
+            slider_seek_time = None
+            state, rewinding = rewind(player, fps_manager, slider_frame_id, state)
 
-        # Count FPS:
-        # window_main.window['text_fps'].update(value='FPS: {:.1f}'.format(real_fps))
+        # Sync the tail of the journal after the last edit:
+        if event_journal is not None:
+            event_journal.poll()
+
+        # Save events in the background:
+        if autosave is not None:
+            if autosave.poll():
+                window_main.window['text_autosave'].update(value='Autosave...')
+            elif not autosave.saving and autosave.num_saves != shown_saves:
+                shown_saves = autosave.num_saves
+                last_save, mean_save = autosave.last_save_ms()
+                window_main.window['text_autosave'].update(
+                    value='Saved: {:.0f} ms (avg {:.0f} ms)'.format(last_save, mean_save)
+                )
 
-        # Read window events:
-        event, values = window_main.window.read(timeout=delay, timeout_key=None)
         if event is None:
             continue
 
@@ -98,9 +187,12 @@ def run_player(video_dir):
                 confirmed = show_conformation_window(header, message)
                 if confirmed:
                     header = 'Подтверждение сохранения в файл'
-                    message = 'Сохранить ивенты в файл\n{}'.format(get_events_path(player.path))
-                    if show_conformation_window(header, message):
-                        event_manager.save(get_events_path(player.path))
+                    message = 'Сохранить ивенты в файл\n{}'.format(get_events_path(player.path, events_format))
+                    save = show_conformation_window(header, message)
+                    if save:
+                        event_manager.validate(warn=True)
+                    autosave.close(save=save)
+                    event_journal.close(discard=not save)
                 else:
                     continue
             player.release()
@@ -118,33 +210,44 @@ def run_player(video_dir):
                 # Check if need to save event file of the current video:
                 if player.is_open():
                     header = 'Подтверждение сохранения в файл'
-                    message = 'Сохранить ивенты в файл\n{}?'.format(get_events_path(player.path))
-                    if show_conformation_window(header, message):
-                        event_manager.save(get_events_path(player.path))
+                    message = 'Сохранить ивенты в файл\n{}?'.format(get_events_path(player.path, events_format))
+                    save = show_conformation_window(header, message)
+                    if save:
+                        event_manager.validate(warn=True)
+                    autosave.close(save=save)
+                    event_journal.close(discard=not save)
                     # Close current video:
                     player.release()
                     event_manager = None
+                    event_journal = None
+                    autosave = None
+                    window_main.window['text_autosave'].update(value='')
                     window_main.clean_evant_table()
                     window_main.set_event_layout_visibility(False)
                     fps_manager = FPSManager()
-                    pil_img = image_np_to_pil(np.zeros((720, 1280, 3), dtype=np.uint8))
-                    window_main.window['image_canvas'].update(data=pil_img)
+                    frame_display.clear(1280, 720)
                     state = State.NOT_OPEN
 
-                # Open new video:
-                player.open(video_path)
+                # Open new video (it starts processes, so the preloading has to be finished):
+                open_start = time.perf_counter()
+                preloading.join()
+                # Frames are decoded right at the display resolution, so the buffers are allocated for it:
+                player.open(video_path, resolution=lambda size: calculate_frame_size(window_main.window.size,
+                                                                                     target_frame_size=size))
                 if player.is_open():
-                    # Set resolution:
-                    frame_size = calculate_frame_size(window_main.window.size, target_frame_size=player.frame_size())
-                    player.set_resolution(frame_size[0], frame_size[1])
-                    # Load events from file:
+                    if window_main.build_event_panels():
+                        profiler.mark('first video opened with event panels', since=open_start)
+                        profiler.report()
+                    # Load events from file (the newest one in either format, events are saved in the selected one):
                     events_path = None
-                    path = get_events_path(player.path)
-                    if os.path.exists(path):
+                    path = get_events_path(player.path, events_format)
+                    saved_path = find_events_path(player.path)
+                    if saved_path is not None or os.path.exists(get_journal_path(path)):
+                        load_path = saved_path if saved_path is not None else path
                         header = 'Подтверждение загрузки из файла'
-                        message = 'Хотите загрузить ивенты из файла\n{}?'.format(path)
+                        message = 'Хотите загрузить ивенты из файла\n{}?'.format(load_path)
                         confirmed =show_conformation_window(header, message)
-                        events_path = path if confirmed else None
+                        events_path = load_path if confirmed else None
                     # Create event manager:
                     home_team, away_team = None, None
                     if events_path is None:
@@ -153,23 +256,33 @@ def run_player(video_dir):
                             player.release()
                             continue
                     event_manager = EventManager(event_types, home_team, away_team, path=events_path)
+                    # Log changes to recover them after a crash (the log of rejected events is moved to a backup):
+                    event_journal = EventJournal(path)
+                    event_journal.attach(event_manager, resume=events_path is not None)
+                    # Rejected events file is not overwritten until the events are saved explicitly:
+                    autosave = AutosaveService(event_manager, path, event_journal, autosave_interval, autosave_edits)
+                    autosave.enabled = events_path is not None or saved_path is None
+                    shown_saves = 0
+                    if event_journal.recovered:
+                        autosave.save()
                     window_main.window.set_title(player.path)
                     window_main.window['-SLIDER-'].update(disabled=False, range=(0, player.num_frames-1), value=0)
                     window_main.window['combo_speed'].update(disabled=False)
                     fps_manager.reset()
-                    fps_manager.set_target_fps(player.video_fps)
                     window_main.set_play_button_state(state='pause')
                     window_main.refresh_event_table(event_manager, player.video_fps)
                     state = State.PLAY_ONCE
                     slider_frame_id = 0
+                    slider_seek_time = None
                     rewinding = False
 
 
         # Navigation: Change playing speed:
         elif event == 'combo_speed':
             speed = float(SPEED_VALUES[values['combo_speed']])
-            target_fps = int(round(player.video_fps*speed))
-            fps_manager.set_target_fps(target_fps)
+            fps_manager.reset()
+            if player.is_open():
+                player.set_speed(speed)
 
         # Navigation: Play / Pause:
         elif event == '-NAVIGATION_PLAY-':
@@ -215,25 +328,32 @@ def run_player(video_dir):
         # Navigation: Rewind (by slider):
         elif event == '-SLIDER-':
             slider_frame_id = int(values['-SLIDER-'])
-            state, rewinding = rewind(player, fps_manager, slider_frame_id, state)
+            # Show the nearest thumbnail right away, the seek itself is coalesced:
+            _, thumbnail = player.preview(slider_frame_id)
+            if thumbnail is not None:
+                frame_size = calculate_frame_size(window_main.window.size, target_frame_size=player.frame_size())
+                frame_display.show_preview(thumbnail, frame_size[0], frame_size[1])
+            slider_seek_time = time.perf_counter()
 
 
         # Save events:
         elif event == 'Сохранить':
             if player.is_open():
-                event_manager.save(get_events_path(player.path))
+                autosave.enabled = True
+                autosave.save()
+                event_manager.validate(warn=True)
 
         # EVENT TABLE:
         elif event == '-EVENT_TABLE-' and player.is_open():
             window_main.set_event_layout_visibility(True)
-            window_main.refresh_edit_event_layout(event_manager, player.video_fps, values['-EVENT_TABLE-'])
+            window_main.refresh_edit_event_layout(event_manager, player.video_fps)
 
         # EVENT PANEL:
         elif event == '-EDIT_EVENT_SET_START_TIME-' and player.is_open():
-            if window_main.set_event_time(player.video_fps, start_frame=player.frame_id):
+            if window_main.set_event_time(event_manager, player.video_fps, start_frame=player.frame_id):
                 window_main.refresh_event_table(event_manager, player.video_fps)
         elif event == '-EDIT_EVENT_SET_END_TIME-' and player.is_open():
-            if window_main.set_event_time(player.video_fps, end_frame=player.frame_id):
+            if window_main.set_event_time(event_manager, player.video_fps, end_frame=player.frame_id):
                 window_main.refresh_event_table(event_manager, player.video_fps)
         elif event == '-EDIT_EVENT_MOVE_TO_START-' and player.is_open():
             start_frame, _ = window_main.get_selected_event_start_and_end()
@@ -260,13 +380,13 @@ def run_player(video_dir):
     window_main.window.close()
 
 
-def read_next_frame(window_main, player, state, rewinding, slider_frame_id):
+def read_next_frame(window_main, player, frame_display, state, rewinding, slider_frame_id):
     frame_size = calculate_frame_size(window_main.window.size, target_frame_size=player.frame_size())
     stopped, img = player.get_frame(frame_size)
-    pil_img = None
 
     if img is not None:
-        pil_img = image_np_to_pil(img)
+        # Update image on the screen:
+        frame_display.show(img)
 
         # Synch slider and cur frame id:
         if not rewinding and slider_frame_id != player.frame_id:
@@ -275,6 +395,11 @@ def read_next_frame(window_main, player, state, rewinding, slider_frame_id):
 
         if rewinding and slider_frame_id == player.frame_id:
             rewinding = False
+            last_seek, mean_seek = player.seek_latency()
+            if last_seek is not None:
+                window_main.window['text_seek'].update(
+                    value='Seek: {:.0f} ms (avg {:.0f} ms)'.format(last_seek, mean_seek)
+                )
 
         # Update frame counter:
         time = str(datetime.timedelta(seconds=int(player.frame_id / player.video_fps)))
@@ -283,11 +408,16 @@ def read_next_frame(window_main, player, state, rewinding, slider_frame_id):
             value='{} / {}    {} / {}'.format(time, total_time, player.frame_id, player.num_frames - 1)
         )
         # Chege playing state:
-        if stopped or state == State.PLAY_ONCE and not rewinding:
+        if state == State.PLAY_ONCE and not rewinding:
             state = State.PAUSE
             window_main.set_play_button_state(state='play')
 
-    return pil_img, state, rewinding, slider_frame_id
+    # Stop at the end of video (no frame is returned then):
+    if stopped and not rewinding and state != State.PAUSE:
+        state = State.PAUSE
+        window_main.set_play_button_state(state='play')
+
+    return state, rewinding, slider_frame_id, img is not None
 
 
 def rewind(player, fps_manager, next_frame_id, state):
@@ -304,6 +434,32 @@ def get_args():
     parser.add_argument("--video-dir", help="path to dir containing videos")
     parser.add_argument("-cvmp", '--enable_cvmp', action='store_true', default=False,
                         help="enable multithreading for opencv")
+    parser.add_argument("--cache-mb", type=int, default=256,
+                        help="memory budget (MB) for decoded frames kept around the playhead for scrubbing")
+    parser.add_argument("--proxy-height", type=int, default=None,
+                        help="play low-resolution proxies of this height (transcoded in the background to VIDEO_DIR/.proxy)")
+    parser.add_argument("--decode-workers", type=int, default=1,
+                        help="number of decoder processes, each decoding its own keyframe-aligned segments "
+                             "(fewer if --buffer-mb can't hold a whole segment per process)")
+    parser.add_argument("--buffer-mb", type=int, default=64,
+                        help="shared memory budget (MB) for frames decoded ahead, the number of frames is tuned "
+                             "to the display resolution")
+    parser.add_argument("--frame-cache-mb", type=int, default=0,
+                        help="disk budget (MB) for decoded frames cached in VIDEO_DIR/.frame_cache, so replayed "
+                             "segments are not decoded again (0 to disable)")
+
+    parser.add_argument("--autosave-interval", type=float, default=30.0,
+                        help="save edited events in the background every AUTOSAVE_INTERVAL seconds")
+    parser.add_argument("--autosave-edits", type=int, default=20,
+                        help="save events in the background after this number of edits")
+
+    parser.add_argument("--events-format", choices=EVENTS_FORMATS, default='json',
+                        help="format of saved events: json or compact columnar npz (both are detected on load)")
+
+    parser.add_argument("--thumbnail-interval", type=float, default=2.0,
+                        help="seconds between slider preview thumbnails cached next to videos (0 to disable)")
+    parser.add_argument("--profile-startup", action='store_true', default=False,
+                        help="print timings of imports and window construction")
 
     return parser.parse_args()
 
@@ -313,7 +469,6 @@ if __name__ == '__main__':
 
     args = get_args()
 
-    if not args.enable_cvmp:
-        disable_opencv_multithreading()
-
-    run_player(args.video_dir)
\ No newline at end of file
+    run_player(args.video_dir, args.cache_mb, args.proxy_height, args.decode_workers,
+               args.autosave_interval, args.autosave_edits, args.events_format, args.enable_cvmp, args.profile_startup,
+               args.thumbnail_interval if args.thumbnail_interval > 0 else None, args.buffer_mb, args.frame_cache_mb)
\ No newline at end of file
@@ -0,0 +1,56 @@
+import time
+import threading
+import importlib
+
+# Imported first by run_player, so it's the reference point of startup timings:
+_START = time.perf_counter()
+
+
+class StartupProfiler:
+    '''
+    Collects timings of startup steps (imports, layout, first interactive frame)
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._marks = []                         # (name, ms since start)
+        self._lock = threading.Lock()            # marks are also added by the preloading thread
+
+    def mark(self, name, since=None):
+        '''
+        Records a step, its duration is counted from 'since' (perf_counter) or from the previous step
+        '''
+        now = (time.perf_counter() - _START) * 1000.0
+        with self._lock:
+            if since is not None:
+                duration = now - (since - _START) * 1000.0
+            else:
+                duration = now - self._marks[-1][1] if len(self._marks) > 0 else now
+            self._marks.append((name, now, duration))
+
+    def report(self):
+        if not self.enabled:
+            return
+        print ('Startup timings (ms):')
+        with self._lock:
+            for name, at, duration in self._marks:
+                print ('   {:>8.1f} {:>8.1f}  {}'.format(at, duration, name))
+
+
+def preload(module_names, profiler=None):
+    '''
+    Imports modules in a background thread, so slow imports (cv2, numpy) overlap with building the GUI.
+    Later imports of the same modules simply wait until they are loaded.
+    The returned thread has to be joined before processes are started, a child forked in the middle of an import
+    inherits the held import lock and hangs on it
+    '''
+    def run():
+        for name in module_names:
+            start = time.perf_counter()
+            importlib.import_module(name)
+            if profiler is not None:
+                profiler.mark('import {} (background)'.format(name), since=start)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,32 @@
+import os
+
+import event_query
+from event_manager import EventManager
+from event_types import EventTypes
+
+TYPES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'event_types.json')
+
+
+def test_matches_and_negative_durations(tmp_path):
+    event_types = EventTypes(TYPES_PATH, cache_path=str(tmp_path / 'event_types.cache'))
+    stype = next(iter(event_types.supertypes.values()))
+    etype = next(iter(stype.types.values()))
+
+    event_manager = EventManager(event_types, 'Home', 'Away')
+    event = event_manager.create_event(etype.supertype, etype.type, 50)
+    event_manager.update_event(event.event_id, end_idx=75)
+    event = event_manager.create_event(etype.supertype, etype.type, 100)
+    event_manager.update_event(event.event_id, end_idx=90)
+    event_manager.save(str(tmp_path / 'first_events.json'))
+
+    # A match without events still counts as loaded:
+    EventManager(event_types, 'Home', 'Away').save(str(tmp_path / 'second_events.npz'))
+
+    table = event_query.load_table(str(tmp_path), event_types, workers=1, read_fps=False)
+    assert len(table) == 2
+    assert table.num_matches == 2
+
+    [(_, stats)] = table.group_by()
+    assert stats['count'] == 2
+    assert stats['finished'] == 1
+    assert stats['duration_total_s'] == 25 / event_query.DEFAULT_FPS
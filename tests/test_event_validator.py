@@ -0,0 +1,38 @@
+import os
+
+import event_columns
+import event_validator
+from event_manager import EventManager
+from event_types import EventTypes
+
+TYPES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'event_types.json')
+
+
+def create_manager(tmp_path):
+    event_types = EventTypes(TYPES_PATH, cache_path=str(tmp_path / 'event_types.cache'))
+    event_manager = EventManager(event_types, 'Home', 'Away')
+    stype = next(iter(event_types.supertypes.values()))
+    etype = next(iter(stype.types.values()))
+    return event_manager, etype
+
+
+def test_negative_frame_is_reported(tmp_path):
+    # An event created before the first frame is shown starts at frame -1:
+    event_manager, etype = create_manager(tmp_path)
+    event = event_manager.create_event(etype.supertype, etype.type, -1)
+    event_manager.update_event(event.event_id, end_idx=10)
+
+    issues = event_manager.validate()
+    assert [(x['event_id'], x['check']) for x in issues] == [(event.event_id, event_validator.NEGATIVE_FRAME)]
+
+
+def test_negative_frame_is_saved(tmp_path):
+    event_manager, etype = create_manager(tmp_path)
+    event = event_manager.create_event(etype.supertype, etype.type, -1)
+    for path in (tmp_path / 'match_events.json', tmp_path / 'match_events.npz'):
+        event_manager.save(str(path))
+        data = EventManager.read_snapshot(str(path))
+        events = {int(event_id): e for event_id, e in data['events'].items()}
+        assert events[event.event_id]['start_frame'] == -1
+        assert events[event.event_id]['end_frame'] is None
+    assert event_columns.to_columns(data)['start_frame'].tolist() == [-1]
@@ -0,0 +1,60 @@
+import time
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+from video_player import VideoPlayer
+
+
+def make_video(path, num_frames=200, size=(640, 360), fps=25):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for frame_id in range(num_frames):
+        frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        cv2.putText(frame, str(frame_id), (50, 250), cv2.FONT_HERSHEY_SIMPLEX, 6, (255, 255, 255), 12)
+        writer.write(frame)
+    writer.release()
+
+
+def play(player, size, last_frame_id, timeout=30.0):
+    '''
+    Plays without pacing until last_frame_id is shown, returns shown frame ids and the stopped flag
+    '''
+    frame_ids, stopped = [], False
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if len(frame_ids) > 0:
+            player.update_playback_anchor()              # request the next frame without pacing
+        stopped, frame = player.get_frame(size)
+        if frame is not None:
+            frame_ids.append(player.frame_id)
+            if player.frame_id >= last_frame_id:
+                break
+        elif stopped:
+            break
+        else:
+            time.sleep(0.001)
+    return frame_ids, stopped
+
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_play_through_cached_run_after_rewind(tmp_path, num_workers):
+    video_path = tmp_path / 'video.mp4'
+    make_video(video_path)
+    size = (320, 180)
+    player = VideoPlayer(buffer_bytes=32*1024*1024, num_workers=num_workers, thumbnail_interval=None)
+    player.open(str(video_path), resolution=size)
+    assert player.num_workers == num_workers
+    try:
+        # Frames 100..170 are shown, so they are served from the scrub cache later:
+        player.rewind(100)
+        frame_ids, _ = play(player, size, 170)
+        assert frame_ids == list(range(100, 171))
+
+        # Play from before the cached run through it to the end:
+        player.rewind(40)
+        frame_ids, stopped = play(player, size, 199)
+        assert frame_ids == list(range(40, 200))
+        assert not stopped
+    finally:
+        frame_ids = None
+        player.release()
@@ -0,0 +1,116 @@
+import os
+import json
+from pathlib import Path
+import numpy as np
+
+from keyframe_index import KeyframeIndex, get_keyframe_index_path, seek
+
+
+def get_thumbnails_path(video_path):
+    p = Path(video_path)
+    video_dir = p.parent.absolute()
+    video_name = p.stem
+
+    return os.path.join(video_dir, video_name + '_thumbs.npy')
+
+
+def get_thumbnails_info_path(thumbnails_path):
+    return os.path.splitext(thumbnails_path)[0] + '.json'
+
+
+class ThumbnailSprite:
+    '''
+    Small thumbnails sampled every 'interval' frames, stored as one memory-mapped (n, h, w, 3) RGB array.
+    While the sprite is being built only the first 'count' thumbnails are valid
+    '''
+    def __init__(self, path, interval, count=None):
+        self.path = path
+        self.interval = interval
+        self.thumbs = np.load(path, mmap_mode='r')
+        self.count = len(self.thumbs) if count is None else count
+
+    def __len__(self):
+        return len(self.thumbs)
+
+    def nearest(self, frame_id, count=None):
+        '''
+        Returns (frame id, thumbnail) of the thumbnail closest to frame_id or (None, None)
+        '''
+        count = self.count if count is None else min(count, len(self.thumbs))
+        if count <= 0:
+            return None, None
+        i = min(max(0, int(round(frame_id / self.interval))), count - 1)
+        return i * self.interval, self.thumbs[i]
+
+    @staticmethod
+    def load(path, video_path):
+        '''
+        Returns the sprite if it's fully built for the current video file (or None)
+        '''
+        info_path = get_thumbnails_info_path(path)
+        if not os.path.exists(path) or not os.path.exists(info_path):
+            return None
+        try:
+            with open(info_path, 'r') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # The sprite is stale if the video has been replaced:
+        stat = os.stat(video_path)
+        if info['video_size'] != stat.st_size or info['video_mtime'] != int(stat.st_mtime):
+            return None
+
+        return ThumbnailSprite(path, info['interval'], info['count'])
+
+    @staticmethod
+    def run_builder(video_path, capture_path, path, interval, width, progress=None):
+        '''
+        Runs worker to sample thumbnails (decoding capture_path, e.g. a proxy) into the memory-mapped sprite.
+        progress (shared Value) holds the number of thumbnails written so far
+        '''
+        import cv2
+        cap = cv2.VideoCapture(capture_path)
+        if not cap.isOpened():
+            return
+        num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        src_width, src_height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        size = (width, max(1, int(round(src_height * width / src_width))))
+        count = (num_frames + interval - 1) // interval
+        index = KeyframeIndex.load(get_keyframe_index_path(capture_path), capture_path)
+
+        # Invalidate the old sprite before overwriting it:
+        info_path = get_thumbnails_info_path(path)
+        if os.path.exists(info_path):
+            os.remove(info_path)
+        thumbs = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(count, size[1], size[0], 3))
+
+        pos, written = 0, 0
+        for i in range(count):
+            # Close targets are reached by decoding forward, distant ones by seeking to a keyframe:
+            pos = seek(cap, pos, i * interval, index)
+            ret, frame = cap.read()
+            if not ret:
+                break
+            pos += 1
+            cv2.resize(frame, size, dst=thumbs[i], interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(thumbs[i], cv2.COLOR_BGR2RGB, dst=thumbs[i])
+            written = i + 1
+            if progress is not None:
+                progress.value = written
+        cap.release()
+        thumbs.flush()
+        del thumbs
+
+        stat = os.stat(video_path)
+        info = {
+            'video_size': stat.st_size,
+            'video_mtime': int(stat.st_mtime),
+            'interval': interval,
+            'count': written,
+            'num_frames': num_frames
+        }
+        tmp_path = info_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, info_path)
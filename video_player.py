@@ -1,122 +1,338 @@
-import cv2
-from multiprocessing import Process, Event, shared_memory, Lock, Value, Array, Queue
+from multiprocessing import Process, Event, shared_memory, Array, Queue, Value
 from queue import Empty
 import numpy as np
 import time
-from datetime import datetime
+import bisect
+import os
+
+from keyframe_index import KeyframeIndex, get_keyframe_index_path, seek
+from frame_cache import FrameCache
+from thumbnails import ThumbnailSprite, get_thumbnails_path
+from disk_frame_cache import DiskFrameCache, get_frame_cache_name
+from proxy import video_hash
+
+
+_cv2 = None
+def import_cv2():
+    '''
+    OpenCV takes long to import, so it's imported on first use (or preloaded in the background)
+    '''
+    global _cv2
+    if _cv2 is None:
+        import cv2
+        cv2.setNumThreads(0)
+        _cv2 = cv2
+    return _cv2
 
 
-cv2.setNumThreads(0)
 def disable_opencv_multithreading():
-    cv2.setNumThreads(0)
+    import_cv2().setNumThreads(0)
 
 
 class SharedFrameBuffer:
-    def __init__(self, shape):
+    '''
+    Lock-free single-producer/single-consumer ring of frames in shared memory.
+    The head index is written only by the producer and the tail index only by the consumer,
+    both live in the shared segment itself. Blocking waits use events instead of sleep-polling.
+    The consumer may reallocate the buffer (e.g. for another resolution), then both switch to the new segment
+    and frames of the old one are dropped
+    '''
+    HEAD, TAIL, RESET = 0, 1, 2
+    _shm = None                                                      # not mapped if attaching has failed
+
+    def __init__(self, shape, name=None, events=None):
+        '''
+        Creates a buffer of shape (slots, height, width, channels) or attaches to the existing segment 'name'
+        (events are shared by all segments of the same producer and consumer)
+        '''
         self._shape = shape                                          # batch, height, width, channels
         self._batch_size = self._shape[0]
-        self._lock = Lock()
-        self._num_frames = Value('i', 0)                             # ready frame counter
-        self._writing_idx = Value('i', 0)
-        self._reading_idx = Value('i', 0)
+        self._not_full, self._not_empty = events if events is not None else (Event(), Event())
 
         # Create shared memory:
-        self._info = np.ndarray((3), dtype=np.int32)                # frame_id, frame_width, frame_height
-        self._bytes = np.ndarray((self._shape[1:]), dtype=np.uint8) # frame bytes
-        self._elem_size = self._info.nbytes + self._bytes.nbytes
-        self._buffer_size = self._elem_size * self._batch_size
-        self._shm = shared_memory.SharedMemory(create=True, size=self._buffer_size)
+        self._header_size = np.dtype(np.int64).itemsize * 3          # head, tail, reset
+        self._info_size = np.dtype(np.int32).itemsize * 4            # frame_id, frame_width, frame_height, generation
+        self._bytes_size = int(np.prod(self._shape[1:]))             # frame bytes
+        self._elem_size = self._info_size + self._bytes_size
+        self._buffer_size = self._header_size + self._elem_size * self._batch_size
+        self._owner = name is None                                   # only the creator unlinks the segment
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=self._buffer_size)
+            self._indices = self._map_indices()
+            self._indices[:] = 0
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._indices = self._map_indices()
 
     def __del__(self):
-        self._shm.close()
+        self.close()
 
-    def clear(self):
-        self._lock.acquire()
-        self._writing_idx.value = 0
-        self._reading_idx.value = 0
-        self._num_frames.value = 0
-        self._lock.release()
+    def __getstate__(self):
+        # The index view is bound to this process' mapping and has to be recreated after unpickling:
+        state = self.__dict__.copy()
+        del state['_indices']
+        state['_owner'] = False
+        return state
 
-    def put(self, frame_id, frame, timeout=0.005):
-        assert frame is not None
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._indices = self._map_indices()
+
+    def _map_indices(self):
+        return self._view(np.int64, 3, 0)
+
+    def _view(self, dtype, count, offset):
+        # Views export the mapping itself, so close() fails instead of unmapping memory that is still in use:
+        return np.frombuffer(self._shm.buf, dtype=dtype, count=count, offset=offset)
+
+    def close(self):
+        '''
+        Unmaps the segment, returns False if frames returned by get() are still in use (then it can be retried)
+        '''
+        self._indices = None
+        if self._shm is None:
+            return True
+        try:
+            self._shm.close()
+        except BufferError:
+            return False
+        return True
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+    def move_to(self, name, shape):
+        '''
+        Attaches the producer to the reallocated segment (raises FileNotFoundError if it's already replaced)
+        '''
+        buffer = SharedFrameBuffer(shape, name, self.events)
+        self.close()
+        return buffer
 
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def events(self):
+        return self._not_full, self._not_empty
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def _slot_offset(self, idx):
+        return self._header_size + self._elem_size * (idx % self._batch_size)
+
+    def _read_tail(self):
+        # Frames written before the last clear() are skipped:
+        return max(int(self._indices[self.TAIL]), int(self._indices[self.RESET]))
+
+    def _num_frames(self):
+        return int(self._indices[self.HEAD]) - self._read_tail()
+
+    def __len__(self):
+        return self._num_frames()
+
+    @property
+    def capacity(self):
+        return self._batch_size
+
+    @property
+    def nbytes(self):
+        return self._buffer_size
+
+    def clear(self):
+        self._indices[self.RESET] = self._indices[self.HEAD]
+        self._not_full.set()
+
+    def reserve(self, shape, timeout=0.1, cancelled=None):
+        '''
+        Waits for a free slot and returns its memory, so a frame can be written into it in place.
+        Returns None if cancelled() becomes True while waiting
+        '''
         # Wait for the buffer to free up space:
-        while True:
-            self._lock.acquire()
-            if self._num_frames.value < self._batch_size - 1: # subtract '1' because we don't copy the memory
-                break                                         # of the current frame in get() below
-            self._lock.release()
-            time.sleep(timeout)
+        while self._num_frames() >= self._batch_size - 1:  # subtract '1' because we don't copy the memory
+            self._not_full.clear()                          # of the current frame in get() below
+            if self._num_frames() < self._batch_size - 1:
+                break
+            self._not_full.wait(timeout)
+            if cancelled is not None and cancelled():
+                return None
 
-        # Prepare buffer element:
-        offset = self._elem_size * self._writing_idx.value
-        frame_info = np.ndarray((self._info.shape), dtype=self._info.dtype, buffer=self._shm.buf[offset:])
-        offset += self._info.nbytes
-        frame_bytes = np.ndarray(frame.shape, dtype=self._bytes.dtype, buffer=self._shm.buf[offset:])
+        assert np.prod(shape) <= self._bytes_size
+        offset = self._slot_offset(int(self._indices[self.HEAD])) + self._info_size
+        return self._view(np.uint8, int(np.prod(shape)), offset).reshape(shape)
 
-        # Write frame to buffer:
-        frame_info[:] = (frame_id, frame.shape[1], frame.shape[0])
+    def commit(self, frame_id, shape, generation=0):
+        '''
+        Publishes the frame written into the reserved slot
+        '''
+        head = int(self._indices[self.HEAD])
+        frame_info = self._view(np.int32, 4, self._slot_offset(head))
+        frame_info[:] = (frame_id, shape[1], shape[0], generation)
+
+        self._indices[self.HEAD] = head + 1
+        self._not_empty.set()
+
+    def put(self, frame_id, frame, timeout=0.1, generation=0):
+        assert frame is not None
+        frame_bytes = self.reserve(frame.shape, timeout)
         frame_bytes[:] = frame[:]
+        self.commit(frame_id, frame.shape, generation)
 
-        self._num_frames.value += 1
-        self._writing_idx.value += 1
-        if self._writing_idx.value >= self._batch_size:
-            self._writing_idx.value = 0
-        self._lock.release()
-
-    def get(self):
-        # Try to pop frame from buffer:
-        self._lock.acquire()
-        if self._num_frames.value <= 0:
-            self._lock.release()
+    def peek(self):
+        '''
+        Returns (frame_id, generation) of the oldest frame without popping it or (None, None) if the buffer is empty
+        '''
+        tail = self._read_tail()
+        if int(self._indices[self.HEAD]) <= tail:
             return None, None
+        frame_info = self._view(np.int32, 4, self._slot_offset(tail))
+
+        return int(frame_info[0]), int(frame_info[3])
+
+    def get(self, timeout=0):
+        '''
+        Pops the oldest frame, returns (frame_id, frame, generation) or (None, None, None) if the buffer is empty
+        '''
+        # Try to pop frame from buffer (optionally waiting for it):
+        tail = self._read_tail()
+        if int(self._indices[self.HEAD]) <= tail:
+            if timeout <= 0:
+                return None, None, None
+            self._not_empty.clear()
+            if int(self._indices[self.HEAD]) <= tail:
+                self._not_empty.wait(timeout)
+            tail = self._read_tail()
+            if int(self._indices[self.HEAD]) <= tail:
+                return None, None, None
 
         # Prepare buffer element:
-        offset = self._elem_size*self._reading_idx.value
-        frame_info = np.ndarray((self._info.shape), dtype=self._info.dtype, buffer=self._shm.buf[offset:])
-        frame_id = int(frame_info[0])
-        shape = (frame_info[2], frame_info[1], 3)
-        offset += self._info.nbytes
-        frame_bytes = np.ndarray(shape, dtype=self._bytes.dtype, buffer=self._shm.buf[offset:])
+        offset = self._slot_offset(tail)
+        frame_info = self._view(np.int32, 4, offset)
+        frame_id, generation = int(frame_info[0]), int(frame_info[3])
+        shape = (int(frame_info[2]), int(frame_info[1]), 3)
+        frame_bytes = self._view(np.uint8, int(np.prod(shape)), offset + self._info_size).reshape(shape)
 
         # Read frame from buffer:
         frame = frame_bytes               # copy() will be needed here if we don't subtract '1' in put() above
 
-        self._num_frames.value -= 1
-        self._reading_idx.value += 1
-        if self._reading_idx.value >= self._batch_size:
-            self._reading_idx.value = 0
-        self._lock.release()
+        # Release the slot:
+        self._indices[self.TAIL] = tail + 1
+        self._not_full.set()
+
+        return frame_id, frame, generation
 
-        return frame_id, frame
+
+def split_segments(num_frames, index, segment_frames):
+    '''
+    Splits video into segments of at least segment_frames starting at keyframes (returns start frame ids)
+    '''
+    if index is None:
+        return list(range(0, max(num_frames, 1), segment_frames))
+
+    bounds = [0]
+    for keyframe in index.keyframes:
+        if keyframe - bounds[-1] >= segment_frames:
+            bounds.append(keyframe)
+
+    return bounds
+
+
+def segment_owner(bounds, frame_id, num_workers):
+    return (bisect.bisect_right(bounds, frame_id) - 1) % num_workers
+
+
+def next_segment(bounds, frame_id):
+    '''
+    Returns the start frame id of the segment following the one of frame_id or None
+    '''
+    segment = bisect.bisect_right(bounds, frame_id)
+    return bounds[segment] if segment < len(bounds) else None
+
+
+def next_owned_frame(bounds, frame_id, worker_idx, num_workers):
+    '''
+    Returns the first frame id at or after frame_id that belongs to the worker's segments or None
+    '''
+    segment = bisect.bisect_right(bounds, frame_id) - 1
+    if segment % num_workers == worker_idx:
+        return frame_id
+    segment += (worker_idx - segment) % num_workers
+
+    return bounds[segment] if segment < len(bounds) else None
 
 
 class VideoPlayer:
     '''
-    Video player with multiprocessing
+    Video player with multiprocessing.
+    With several workers each of them decodes its own keyframe-aligned segments (round-robin)
+    into its own buffer, and get_frame() reassembles frames in frame id order
     '''
     class Messages:
         NONE = 0
-        REWIND = 1
         SET_RESOLUTION = 2
         TERMINATE = 3
+        SET_SPEED = 4
+        SET_SEGMENTS = 5
+
+    MIN_BUFFER_FRAMES = 3
+    RESIZE_DELAY = 0.2                           # seconds the size has to stay the same before buffers are reallocated
+    MIN_CACHED_RUN = 10                          # cached frames ahead that are worth seeking the workers over
 
-    def __init__(self, buffer_size=300):
-        self._buffer_size = buffer_size
+    def __init__(self, buffer_size=300, buffer_bytes=64*1024*1024, cache_bytes=256*1024*1024, proxy_manager=None,
+                 num_workers=1, segment_frames=50, max_segment_frames=200, thumbnail_interval=2.0,
+                 thumbnail_width=160, disk_cache_dir=None, disk_cache_bytes=0):
+        self._buffer_size = buffer_size          # max number of slots per worker
+        self._buffer_bytes = buffer_bytes        # shared memory budget of all workers (None to always use buffer_size)
+        self._segment_slots = 0                  # slots a worker needs to hold a whole segment
+        self._budget_warned = False
+        self._proxy_manager = proxy_manager
+        self._max_workers = num_workers
+        self._num_workers = num_workers          # workers of the open video (fewer if the budget can't hold them)
+        self._segment_frames = segment_frames
+        self._max_segment_frames = max_segment_frames
+        self._cache = FrameCache(cache_bytes)    # decoded frames around the playhead for scrubbing
+        self._disk_cache_dir = disk_cache_dir    # decoded frames for repeated review (None to disable)
+        self._disk_cache_bytes = disk_cache_bytes
+        self._video_key = None
         self._path = ''
+        self._capture_path = ''                  # either the video itself or its low-resolution proxy
         self._openned = False
         self._video_timestep = None
+        self._speed = 1.0
+        self._dropped_frames = 0                 # frames skipped to keep up with playback
+        self._late_frames = 0                    # frames that were not decoded by their presentation time
+        self._late_frame_id = None
+        self._cache_ms = 0.0                     # time spent to copy shown frames into the scrub cache
+        self._cache_count = 0
         self._video_fps = 0
         self._num_frames = 0
         self._width = 0
         self._height = 0
         self._frame_id = -1
         self._rewind_step = 2.0                  # 10 seconds
-        self._buffer = None
-        self._worker = None
-        self._worker_terminated = None
-        self._messages = None
-        self._video_ended = None
+        self._segments = [0]                     # start frame ids of segments decoded by different workers
+        self._buffers = []                       # buffers the frames are read from (one per worker)
+        self._retired_buffers = []               # buffers whose frames may still be in use
+        self._workers = []
+        self._worker_terminated = []
+        self._messages = []
+        self._video_ended = []
+        self._seek_stats = None                  # last latency (ms), total latency (ms), number of seeks
+        self._seek_request = None                # shared (generation, frame id) of the latest seek
+        self._seek_generation = 0
+        self._decode_frame_id = 0                # frame id the workers were last sent to
+        self._resize = None                      # (size, time) of the last requested size differing from the workers'
+        self._index_path = None
+        self._index_builder = None
+        self._thumbnail_interval = thumbnail_interval    # seconds between slider previews (None to disable)
+        self._thumbnail_width = thumbnail_width
+        self._thumbnails = None
+        self._thumbnail_builder = None
+        self._thumbnail_progress = None          # number of thumbnails sampled by the builder
         # Anchor is required to control the playback FPS:
         self._playback_anchor_time = None
         self._playback_anchor_frame_id = None
@@ -124,59 +340,315 @@ class VideoPlayer:
     def __del__(self):
         self.release()
 
-    def open(self, video_path):
+    def open(self, video_path, resolution=None):
+        '''
+        Opens video, frames are decoded at the given resolution, which is either (width, height)
+        or a function of the source (width, height) returning it (the source resolution by default)
+        '''
         assert video_path is not None and len(video_path)
 
         # Release current video if it is open:
         self.release()
         self.update_playback_anchor(0)
 
+        # Play the low-resolution proxy transparently if it is ready (frame ids are identical):
+        capture_path = video_path
+        if self._proxy_manager is not None:
+            proxy_path = self._proxy_manager.find_proxy(video_path)
+            if proxy_path is not None:
+                capture_path = proxy_path
+
         # Temporarily open the video to get some info:
+        cv2 = import_cv2()
         cap = cv2.VideoCapture(video_path)
         assert cap.isOpened()
-        self._video_fps = int(round(cap.get(cv2.CAP_PROP_FPS)))
-        self._num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         self._width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self._height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if capture_path != video_path:
+            cap.release()
+            cap = cv2.VideoCapture(capture_path)
+            assert cap.isOpened()
+        self._video_fps = int(round(cap.get(cv2.CAP_PROP_FPS)))
+        self._num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         self._video_timestep = 1000.0 / self._video_fps
         cap.release()
+        if resolution is not None:
+            self._width, self._height = resolution((self._width, self._height)) if callable(resolution) \
+                else resolution
 
         # Init variables:
         self._path = video_path
-        self._video_ended = Event()
-        self._worker_terminated = Event()
-        self._messages = Queue(500)
-        self._buffer = SharedFrameBuffer(shape=(self._buffer_size, self._height, self._width, 3))
-
-        # Run capture worker:
-        args = (self._path, self._buffer, (self._width, self._height), self._messages, self._video_ended, self._worker_terminated)
-        self._worker = Process(target=VideoPlayer.run_capture, args=args)
-        self._worker.start()
+        self._capture_path = capture_path
+        self._seek_stats = Array('d', 3)
+        self._seek_request = Array('q', 2)
+        self._seek_generation = 0
+        self._decode_frame_id = 0
+
+        # Build keyframe index in the background if it is not cached yet
+        # (until it is ready segments of several workers are split by frame count and seeks are slower):
+        index_path = get_keyframe_index_path(self._capture_path)
+        self._index_path = index_path
+        index = KeyframeIndex.load(index_path, self._capture_path)
+        if index is None:
+            self._index_builder = Process(target=KeyframeIndex.run_builder,
+                                          args=(self._capture_path, index_path), daemon=True)
+            self._index_builder.start()
+
+        # Sample thumbnails for slider previews in the background if they are not cached yet:
+        if self._thumbnail_interval is not None:
+            thumbnails_path = get_thumbnails_path(self._path)
+            self._thumbnails = ThumbnailSprite.load(thumbnails_path, self._path)
+            if self._thumbnails is None:
+                interval = max(1, int(round(self._thumbnail_interval * self._video_fps)))
+                self._thumbnail_progress = Value('i', 0)
+                self._thumbnail_builder = Process(target=ThumbnailSprite.run_builder, daemon=True,
+                                                  args=(self._path, self._capture_path, thumbnails_path, interval,
+                                                        self._thumbnail_width, self._thumbnail_progress))
+                self._thumbnail_builder.start()
+
+        # Split video into segments between workers:
+        self._segment_slots = 0
+        self._budget_warned = False
+        self._segments = [0]
+        self._num_workers = self._max_workers
+        if self._num_workers > 1:
+            self._split_segments(index)
+            self._fit_workers()
+
+        # Frames decoded earlier are cached on disk per video and resolution:
+        disk_cache = None
+        if self._disk_cache_dir is not None and self._disk_cache_bytes > 0:
+            os.makedirs(self._disk_cache_dir, exist_ok=True)
+            self._video_key = video_hash(self._capture_path)
+            self._evict_disk_cache()
+            disk_cache = (self._disk_cache_dir, self._video_key, self._disk_cache_bytes // self._num_workers)
+
+        # Run capture workers:
+        for worker_idx in range(self._num_workers):
+            self._video_ended.append(Event())
+            self._worker_terminated.append(Event())
+            self._messages.append(Queue(500))
+            self._buffers.append(SharedFrameBuffer(shape=self.buffer_shape(self._width, self._height)))
+            args = (self._capture_path, self._buffers[-1], (self._width, self._height), self._messages[-1],
+                    self._video_ended[-1], self._worker_terminated[-1], index_path, self._seek_stats,
+                    self._seek_request, self._segments, worker_idx, self._num_workers, self.frame_step(), disk_cache)
+            self._workers.append(Process(target=VideoPlayer.run_capture, args=args))
+            self._workers[-1].start()
         self._openned = True
 
     def release(self):
         # Release current video if it is open:
         if self._openned:
-            self._messages.put((self.Messages.TERMINATE, None))
-            self._buffer.clear()
-            self._worker_terminated.wait()
-            self._messages.close()
+            self._cache.clear()
+            for messages, buffer in zip(self._messages, self._buffers):
+                messages.put((self.Messages.TERMINATE, None))
+                buffer.clear()
+            for worker, worker_terminated, messages, buffer in \
+                    zip(self._workers, self._worker_terminated, self._messages, self._buffers):
+                # The worker may fill the buffer again before it reads the message, so keep freeing it up:
+                while not worker_terminated.wait(0.05) and worker.is_alive():
+                    buffer.clear()
+                messages.close()
+            for buffer in self._buffers:
+                self._retire_buffer(buffer)
+            self._buffers = []
+            self._workers = []
+            self._worker_terminated = []
+            self._messages = []
+            self._video_ended = []
+            if self._thumbnail_builder is not None:
+                # An unfinished sprite is rebuilt the next time:
+                self._thumbnail_builder.terminate()
+                self._thumbnail_builder.join()
+            self._thumbnail_builder = None
+            self._thumbnail_progress = None
+            self._thumbnails = None
+            self._video_key = None
             self._openned = False
 
+    def _split_segments(self, index):
+        self._segments = split_segments(self._num_frames, index, self._segment_frames)
+        # Each worker should be able to hold a whole segment to decode ahead while others are playing:
+        bounds = self._segments + [self._num_frames]
+        max_segment = max(bounds[i+1] - bounds[i] for i in range(len(self._segments)))
+        self._segment_slots = min(max_segment, self._max_segment_frames) + 1
+
+    def _fit_workers(self):
+        '''
+        Reduces the number of workers until each of them can hold a whole segment within the memory budget
+        '''
+        if self._buffer_bytes is None:
+            return
+        frame_bytes = self._width * self._height * 3
+        num_workers = self._num_workers
+        while num_workers > 1 and self._buffer_bytes // (num_workers * frame_bytes) < self._segment_slots:
+            num_workers -= 1
+        if num_workers < self._num_workers:
+            print ('[Warning] Buffer budget of {:.0f} MB holds segments of {} of {} workers at {}x{}, '
+                   'the others are not started (increase the budget to use them)'.format(
+                       self._buffer_bytes / 2**20, num_workers, self._num_workers, self._width, self._height))
+            self._num_workers = num_workers
+        if num_workers == 1:
+            self._segments = [0]
+            self._segment_slots = 0
+
+    def _poll_index_builder(self):
+        '''
+        Re-splits segments of several workers at keyframes once the index is built
+        '''
+        if self._index_builder.is_alive():
+            return
+        self._index_builder.join()
+        self._index_builder = None
+        index = KeyframeIndex.load(self._index_path, self._capture_path)
+        if self._num_workers == 1 or index is None:
+            return
+
+        segments = self._segments
+        self._split_segments(index)
+        if self._segments == segments:
+            return
+        for messages in self._messages:
+            messages.put((self.Messages.SET_SEGMENTS, self._segments))
+        # Decoded frames may belong to other workers now, so the workers restart from the next frame to show:
+        if self.buffer_shape(self._width, self._height) != self._buffers[0].shape:
+            self._reallocate_buffers()
+        else:
+            self._restart_workers()
+
     def set_resolution(self, width, height):
         assert self._openned
         if width != self._width or height != self._height:
             self._width = width
             self._height = height
-            self._messages.put((self.Messages.SET_RESOLUTION, (width, height)))
+            self._reallocate_buffers()
+            if self._video_key is not None:
+                self._evict_disk_cache()
+
+    def _reallocate_buffers(self):
+        '''
+        Reallocates worker buffers for the current resolution. Decoded frames are dropped with the old buffers,
+        so the workers restart from the next frame (like after a seek)
+        '''
+        shape = self.buffer_shape(self._width, self._height)
+        reallocated = False
+        for worker_idx, messages in enumerate(self._messages):
+            segment = None
+            old_buffer = self._buffers[worker_idx]
+            if old_buffer.shape != shape:
+                self._buffers[worker_idx] = SharedFrameBuffer(shape, events=old_buffer.events)
+                self._retire_buffer(old_buffer)
+                segment = (self._buffers[worker_idx].name, shape)
+                reallocated = True
+            messages.put((self.Messages.SET_RESOLUTION, ((self._width, self._height), segment)))
+        if reallocated:
+            self._restart_workers()
+
+    def _evict_disk_cache(self):
+        # Files of the current resolution are in use by the workers:
+        keep = [get_frame_cache_name(self._video_key, (self._width, self._height), worker_idx)
+                for worker_idx in range(self._num_workers)]
+        DiskFrameCache.evict(self._disk_cache_dir, self._disk_cache_bytes, keep)
+
+    def buffer_shape(self, width, height):
+        '''
+        Returns the shape of worker buffers for frames of the given size: as many slots as fit into the memory budget.
+        With several workers each of them should hold a whole segment (see _fit_workers()), but the budget is binding,
+        e.g. at a higher resolution workers decode less ahead. Only MIN_BUFFER_FRAMES slots are always allocated
+        '''
+        num_frames = max(self._buffer_size, self._segment_slots)
+        if self._buffer_bytes is not None:
+            frame_bytes = width * height * 3
+            num_frames = min(num_frames, self._buffer_bytes // (self._num_workers * frame_bytes))
+            if num_frames < max(self._segment_slots, self.MIN_BUFFER_FRAMES) and not self._budget_warned:
+                print ('[Warning] Buffer budget of {:.0f} MB holds {} frames per worker at {}x{}, '
+                       'decoding ahead is limited (increase the budget)'.format(
+                           self._buffer_bytes / 2**20, num_frames, width, height))
+                self._budget_warned = True
+
+        return (max(self.MIN_BUFFER_FRAMES, num_frames), height, width, 3)
+
+    def _retire_buffer(self, buffer):
+        # The segment is freed once it is unmapped, which has to wait until its frames are not used anymore:
+        buffer.unlink()
+        if not buffer.close():
+            self._retired_buffers.append(buffer)
+
+    def _close_retired_buffers(self):
+        self._retired_buffers = [buffer for buffer in self._retired_buffers if not buffer.close()]
 
     def rewind(self, next_frame_id):
         assert self._openned
-        try:
-            self._messages.put_nowait((self.Messages.REWIND, next_frame_id))
-            self.update_playback_anchor(next_frame_id)
-        except:
-            pass
+        # Frames that are already cached will be served without decoding, so the workers continue after them:
+        self._seek_workers(self._cache.contiguous_end(next_frame_id, (self._width, self._height)))
+        self.update_playback_anchor(next_frame_id)
+
+    def _seek_workers(self, frame_id):
+        # Only the latest request is kept, so a burst of seeks results in one seek of the workers:
+        self._seek_generation += 1
+        with self._seek_request.get_lock():
+            self._seek_request[:] = (self._seek_generation, frame_id)
+        self._decode_frame_id = frame_id
+        # The end of video is reported again by the workers if the seek is beyond it:
+        for video_ended in self._video_ended:
+            video_ended.clear()
+
+    def _skip_cached_run(self, frame_id, size):
+        '''
+        Drops decoded frames up to the frame served from the scrub cache, so the workers don't stall behind a cached run.
+        Before a long run they are sent to its end (like in rewind())
+        '''
+        for buffer in self._buffers:
+            while True:
+                next_frame_id, generation = buffer.peek()
+                if next_frame_id is None or next_frame_id > frame_id and generation == self._seek_generation:
+                    break
+                buffer.get()
+
+        decode_frame_id = self._cache.contiguous_end(frame_id + 1, size)
+        if decode_frame_id - frame_id > self.MIN_CACHED_RUN and decode_frame_id > self._decode_frame_id:
+            # The workers may have decoded past the run already:
+            worker_idx = segment_owner(self._segments, decode_frame_id, self._num_workers)
+            next_frame_id, _ = self._buffers[worker_idx].peek()
+            if next_frame_id is None or next_frame_id < decode_frame_id:
+                self._seek_workers(decode_frame_id)
+
+    def _restart_workers(self):
+        '''
+        Restarts decoding from the next frame to show, which is the target of a pending seek if there is one.
+        Unlike rewind() the playback anchor is kept, so playback continues without a hiccup
+        '''
+        next_frame_id = self._playback_anchor_frame_id if self._playback_anchor_time is None else self._frame_id + 1
+        self._seek_workers(self._cache.contiguous_end(next_frame_id, (self._width, self._height)))
+
+    def preview(self, frame_id):
+        '''
+        Returns (frame id, RGB thumbnail) closest to frame_id without decoding or (None, None) if not available yet
+        '''
+        if self._thumbnail_progress is None:
+            return self._thumbnails.nearest(frame_id) if self._thumbnails is not None else (None, None)
+
+        # The sprite is being built, only the sampled thumbnails can be shown:
+        count = self._thumbnail_progress.value
+        if count == 0:
+            return None, None
+        if self._thumbnails is None:
+            interval = max(1, int(round(self._thumbnail_interval * self._video_fps)))
+            self._thumbnails = ThumbnailSprite(get_thumbnails_path(self._path), interval)
+        return self._thumbnails.nearest(frame_id, count)
+
+    def set_speed(self, speed):
+        self._speed = speed
+        self.update_playback_anchor()
+        # Workers skip frames that won't be shown at this speed:
+        for messages in self._messages:
+            messages.put((self.Messages.SET_SPEED, self.frame_step()))
+
+    def frame_step(self):
+        '''
+        Returns the step between displayed frames at the current speed
+        '''
+        return max(1, int(self._speed))
 
     def update_playback_anchor(self, target_frame_id=None):
         if target_frame_id is None:
@@ -186,39 +658,113 @@ class VideoPlayer:
 
     def get_frame(self, size):
         assert self._openned
+        if len(self._retired_buffers) > 0:
+            self._close_retired_buffers()
+        if self._index_builder is not None:
+            self._poll_index_builder()
 
         # Control playback FPS:
         target_frame_id = None
         if self._playback_anchor_time is not None:
-            elapsed = (datetime.now() - self._playback_anchor_time).total_seconds()
-            offset = int(round(elapsed * 1000.0 / self._video_timestep))     # in frames
+            elapsed = (time.perf_counter_ns() - self._playback_anchor_time) / 1e6                  # in ms
+            offset = int(round(elapsed * self._speed / self._video_timestep))                # in frames
             target_frame_id = self._playback_anchor_frame_id + offset
-            # The target frame has already been read:
-            if target_frame_id == self._frame_id:
+            # The target frame has already been read (at a higher speed frames are read ahead of it):
+            if target_frame_id <= self._frame_id:
                 return False, None
 
-        # Pop frames from buffer:
-        while True:
-            frame_id, frame = self._buffer.get()
-            # Read until the target frame is found:
-            if frame_id is None or target_frame_id is None or frame_id >= target_frame_id:
-                break
+        # Frames are resized by the workers, so let them know about the new size once it stops changing
+        # (e.g. while the window is dragged frames are resized below):
+        if size[0] != self._width or size[1] != self._height:
+            now = time.perf_counter()
+            if self._resize is None or self._resize[0] != size:
+                self._resize = (size, now)
+            elif now - self._resize[1] >= self.RESIZE_DELAY:
+                self._resize = None
+                self.set_resolution(size[0], size[1])
 
-        # Update frame_id if frame is read:
+        prev_frame_id = self._frame_id
+
+        # Try to serve the frame from the scrub cache:
+        wanted_frame_id = target_frame_id if target_frame_id is not None else self._playback_anchor_frame_id
+        frame = self._cache.get(wanted_frame_id, size)
         if frame is not None:
-            self._frame_id = frame_id
-            if (size[0] != frame.shape[1] or size[1] != frame.shape[0]):
-                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            self._frame_id = wanted_frame_id
+            self._skip_cached_run(wanted_frame_id, size)
+        else:
+            # Pop frames from the buffer of the worker decoding the wanted frame:
+            worker_idx = segment_owner(self._segments, wanted_frame_id, self._num_workers)
+            while True:
+                # Frames skipped at a higher speed may take the rest of the segment, then its worker is already
+                # in the next owned segment (or at the end) and the next frame is decoded by the next worker:
+                next_segment_id = next_segment(self._segments, wanted_frame_id)
+                if self._num_workers > 1 and next_segment_id is not None:
+                    ended = self._video_ended[worker_idx].is_set()       # checked first, the last frame is put before
+                    next_frame_id, generation = self._buffers[worker_idx].peek()
+                    if next_frame_id is None and ended or \
+                            generation == self._seek_generation and next_frame_id >= next_segment_id:
+                        wanted_frame_id = next_segment_id
+                        worker_idx = segment_owner(self._segments, wanted_frame_id, self._num_workers)
+                        continue
+                frame_id, frame, generation = self._buffers[worker_idx].get()
+                # Frames decoded before the last seek are dropped:
+                if frame is not None and generation != self._seek_generation:
+                    frame = None
+                    continue
+                # Read until the target frame is found:
+                if frame_id is None or target_frame_id is None or frame_id >= target_frame_id:
+                    break
+
+            # Update frame_id if frame is read:
+            if frame is not None:
+                self._frame_id = frame_id
+                # Frames of another resolution (e.g. while the window size is changing) are resized here:
+                if (size[0] != frame.shape[1] or size[1] != frame.shape[0]):
+                    cv2 = import_cv2()
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                # Only shown frames are cached for scrubbing, the copy is a part of drawing time:
+                start = time.perf_counter_ns()
+                self._cache.put(frame_id, frame, self._frame_id)
+                self._cache_ms += (time.perf_counter_ns() - start) / 1e6
+                self._cache_count += 1
+
+        # Count dropped and late frames during continuous playback (frames skipped at a higher speed are not dropped):
+        if target_frame_id is not None:
+            if frame is not None:
+                self._dropped_frames += max(0, self._frame_id - prev_frame_id - self.frame_step())
+            elif target_frame_id > self._frame_id and target_frame_id != self._late_frame_id:
+                self._late_frames += 1
+                self._late_frame_id = target_frame_id
 
         # Update playback anchor:
         if self._playback_anchor_time is None and \
                 self._frame_id is not None and self._frame_id == self._playback_anchor_frame_id:
-            self._playback_anchor_time = datetime.now()
+            self._playback_anchor_time = time.perf_counter_ns()
 
-        stopped = True if frame is None and self._video_ended.is_set() else False
+        stopped = True if frame is None and all(e.is_set() for e in self._video_ended) else False
 
         return stopped, frame
 
+    def next_frame_delay(self):
+        '''
+        Returns seconds left until get_frame() will return the next frame (0 if it is already due)
+        '''
+        if self._playback_anchor_time is None:
+            return 0.0
+
+        # The target frame is rounded in get_frame(), so the next frame is due half a frame earlier:
+        offset = (self._frame_id + 0.5 - self._playback_anchor_frame_id) * self._video_timestep / self._speed
+        due_time = self._playback_anchor_time + offset * 1e6
+
+        return max(0.0, (due_time - time.perf_counter_ns()) / 1e9)
+
+    def playback_stats(self):
+        return self._dropped_frames, self._late_frames
+
+    @property
+    def cache_mean_ms(self):
+        return self._cache_ms / self._cache_count if self._cache_count > 0 else 0.0
+
     def is_open(self):
         return self._openned
 
@@ -238,60 +784,244 @@ class VideoPlayer:
     def path(self):
         return self._path
 
+    @property
+    def capture_path(self):
+        return self._capture_path
+
+    @property
+    def num_workers(self):
+        return self._num_workers
+
     def frame_size(self):
         return (self._width, self._height)
 
     def rewind_step(self):
         return self._rewind_step
 
+    def buffer_occupancy(self):
+        '''
+        Returns the number of decoded frames waiting in the buffers and the total number of slots
+        '''
+        return sum(len(b) for b in self._buffers), sum(b.capacity for b in self._buffers)
+
+    def buffer_nbytes(self):
+        return sum(b.nbytes for b in self._buffers)
+
+    def seek_latency(self):
+        '''
+        Returns the last and the mean seek latency in milliseconds (time from a seek to the first decoded frame)
+        '''
+        if self._seek_stats is None or self._seek_stats[2] == 0:
+            return None, None
+        with self._seek_stats.get_lock():
+            last, total, count = self._seek_stats[:]
+        return last, total / count
+
     @staticmethod
-    def run_capture(path, buffer, resolution, messages, video_ended, worker_terminated):
+    def run_capture(path, buffer, resolution, messages, video_ended, worker_terminated, index_path, seek_stats,
+                    seek_request, segments=(0,), worker_idx=0, num_workers=1, step=1, disk_cache=None):
         '''
-        Runs worker to capture frames from video
+        Runs worker to capture frames from video (only the segments owned by the worker).
+        Only every step-th frame is decoded to RGB, the others are grabbed without retrieving.
+        seek_request holds (generation, frame id) of the latest seek, work for older generations is abandoned.
+        disk_cache is (cache dir, video key, max bytes) of DiskFrameCache, cached frames are copied instead of decoded
         '''
+        cv2 = import_cv2()
         cap = cv2.VideoCapture(path)
         assert cap is not None and cap.isOpened()
         video_ended.clear()
-        frame_id = -1
+        frame_id = -1                            # the last frame put into the buffer
+        cap_frame_id = -1                        # the last frame read from the capture
+        index = None
+        seek_start = None
+        step_base = 0                            # decoded frames are step_base + k * step
+        generation = 0
 
-        while True:
-            # Read message:
-            cmd, value = None, None
+        def superseded():
+            return seek_request[0] != generation
+
+        def interrupted():
+            return superseded() or not messages.empty()
+
+        def open_disk_cache():
+            return DiskFrameCache(*disk_cache[:2], resolution, disk_cache[2], worker_idx) \
+                if disk_cache is not None else None
+
+        def sync_capture():
+            '''
+            Moves the capture to frame_id + 1 after a seek or frames copied from the disk cache
+            '''
+            nonlocal index, cap_frame_id
+            if cap_frame_id != frame_id:
+                # The index is built in the background, so pick it up once it appears:
+                if index is None and os.path.exists(index_path):
+                    index = KeyframeIndex.load(index_path, path)
+                cap_frame_id = seek(cap, cap_frame_id + 1, frame_id + 1, index, superseded) - 1
+            return cap_frame_id == frame_id
+
+        def read_messages():
+            '''
+            Applies queued messages, returns True if the worker has to terminate
+            '''
+            nonlocal resolution, buffer, frame_bytes, frame_cache, step, step_base, generation, segments
+            terminate = False
             while True:
                 try:
                     cmd, value = messages.get_nowait()
                 except Empty:
                     break
-
-            if cmd is not None:
-                if cmd == VideoPlayer.Messages.REWIND:
-                    buffer.clear()
-                    video_ended.clear()
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, value)
-                    frame_id = value - 1
-                elif cmd == VideoPlayer.Messages.SET_RESOLUTION:
-                    resolution = value
+                if cmd == VideoPlayer.Messages.SET_RESOLUTION:
+                    size, segment = value
+                    if segment is not None:
+                        frame_bytes = None               # the old buffer can't be unmapped while it's viewed
+                        try:
+                            buffer = buffer.move_to(*segment)
+                            # Frames of the old buffer are dropped, so the latest seek is done again:
+                            generation = -1
+                        except FileNotFoundError:
+                            continue                     # the buffer is already replaced by a following message
+                    resolution = size
+                    if frame_cache is not None:
+                        frame_cache.close()
+                        frame_cache = open_disk_cache()
+                elif cmd == VideoPlayer.Messages.SET_SPEED:
+                    step, step_base = value, frame_id + 1
+                elif cmd == VideoPlayer.Messages.SET_SEGMENTS:
+                    segments = value
+                    # The latest seek may have been done with the old segments:
+                    generation = -1
                 elif cmd == VideoPlayer.Messages.TERMINATE:
-                    break
+                    terminate = True
+            return terminate
+
+        # Start from the first owned segment:
+        frame_bytes = None
+        start_frame_id = next_owned_frame(segments, 0, worker_idx, num_workers)
+        if start_frame_id is None:
+            video_ended.set()
+        elif start_frame_id > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame_id)
+            frame_id = cap_frame_id = start_frame_id - 1
+        frame_cache = open_disk_cache()
+
+        while True:
+            if read_messages():
+                break
+
+            # Seek to the latest requested frame (requests superseded before being read are never executed):
+            rewind_frame_id = None
+            if superseded():
+                with seek_request.get_lock():
+                    generation, rewind_frame_id = int(seek_request[0]), int(seek_request[1])
+
+            if rewind_frame_id is not None:
+                buffer.clear()
+                video_ended.clear()
+                # Skip to the first frame of an owned segment:
+                target_frame_id = next_owned_frame(segments, rewind_frame_id, worker_idx, num_workers)
+                if target_frame_id is None:
+                    video_ended.set()
+                else:
+                    if target_frame_id == rewind_frame_id:
+                        seek_start = time.perf_counter()
+                    # The capture is moved only when the frames are not in the disk cache:
+                    frame_id = target_frame_id - 1
+                    step_base = rewind_frame_id
 
             if video_ended.is_set():
                 time.sleep(0.01)
                 continue
 
-            # Read next frame:
-            _, frame = cap.read()
+            # Fast-forward: advance to the next displayed frame without retrieving (converting) the skipped ones:
+            if step > 1:
+                skip = -(frame_id + 1 - step_base) % step
+                next_frame_id = next_owned_frame(segments, frame_id + 1 + skip, worker_idx, num_workers)
+                if next_frame_id is None:
+                    video_ended.set()
+                    continue
+                if next_frame_id != frame_id + 1 + skip:
+                    # The skip ran past the segment, so it's counted again from the next owned segment:
+                    frame_id = next_frame_id - 1
+                    continue
+                if frame_cache is None or next_frame_id not in frame_cache:
+                    if not sync_capture():
+                        if not superseded():
+                            video_ended.set()
+                        continue
+                    while skip > 0 and cap.grab():
+                        frame_id += 1
+                        cap_frame_id += 1
+                        skip -= 1
+                    if skip > 0:
+                        video_ended.set()
+                        continue
+                else:
+                    frame_id = next_frame_id - 1
+
+            # Read next frame (unless it's in the disk cache):
+            cached = frame_cache is not None and frame_id + 1 in frame_cache
+            if not cached:
+                if not sync_capture():
+                    if not superseded():
+                        video_ended.set()
+                    continue
+                _, frame = cap.read()
+                if frame is None:
+                    video_ended.set()
+                    continue
+                cap_frame_id += 1
             frame_id = frame_id + 1
 
-            if frame is None:
-                video_ended.set()
+            # Wait for a free slot (unless a newer seek arrives), messages are applied while waiting,
+            # so a blocked worker still moves to a reallocated buffer:
+            terminate = False
+            while True:
+                frame_bytes = buffer.reserve((resolution[1], resolution[0], 3), cancelled=interrupted)
+                if frame_bytes is not None or superseded():
+                    break
+                terminate = read_messages()
+                if terminate or cached:
+                    break
+            if terminate:
+                break
+            if frame_bytes is None:
+                if cached and not superseded():
+                    frame_id -= 1            # the disk cache may have changed with the resolution, so look it up again
                 continue
+
+            # Resize and convert frame to display-ready RGB right in the buffer:
+            if cached:
+                frame_cache.read(frame_id, frame_bytes)
             else:
-                if frame.shape[:2] != resolution[:2]:
-                    frame = cv2.resize(frame, resolution, interpolation=cv2.INTER_AREA)
+                if frame.shape[1] != resolution[0] or frame.shape[0] != resolution[1]:
+                    cv2.resize(frame, resolution, dst=frame_bytes, interpolation=cv2.INTER_AREA)
+                    cv2.cvtColor(frame_bytes, cv2.COLOR_BGR2RGB, dst=frame_bytes)
+                else:
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame_bytes)
+                if frame_cache is not None:
+                    frame_cache.write(frame_id, frame_bytes)
+            buffer.commit(frame_id, frame_bytes.shape, generation)
 
-            # Put frame in the buffer:
-            buffer.put(frame_id, frame)
+            # Measure seek latency:
+            if seek_start is not None:
+                latency = (time.perf_counter() - seek_start) * 1000.0
+                with seek_stats.get_lock():
+                    seek_stats[0] = latency
+                    seek_stats[1] += latency
+                    seek_stats[2] += 1
+                seek_start = None
+
+            # Jump over the segments of other workers:
+            next_frame_id = next_owned_frame(segments, frame_id + 1, worker_idx, num_workers)
+            if next_frame_id is None:
+                video_ended.set()
+            elif next_frame_id != frame_id + 1:
+                frame_id = next_frame_id - 1
 
         video_ended.set()
         cap.release()
-        worker_terminated.set()
\ No newline at end of file
+        if frame_cache is not None:
+            frame_cache.close()
+        frame_bytes = None
+        buffer.close()
+        worker_terminated.set()
@@ -0,0 +1,94 @@
+import bisect
+
+from windows.utils import frame_id_to_time_stamp
+
+
+class EventTableModel:
+    '''
+    Keeps sg.Table rows in sync with EventManager by diffs: change notifications of the manager
+    insert, update or remove only the touched rows. Rows are kept sorted by start frame (latest first)
+    '''
+    def __init__(self, sg_table):
+        self._tree = sg_table.Widget             # ttk.Treeview, row iids are event ids
+        self._event_manager = None
+        self._video_fps = None
+        self._keys = []                          # sorted row keys: (-start_idx, -event_id)
+        self._row_keys = {}                      # event_id -> row key
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def event_manager(self):
+        return self._event_manager
+
+    def attach(self, event_manager, video_fps):
+        self.detach()
+        self._event_manager = event_manager
+        self._video_fps = video_fps
+        for event in event_manager.events.values():
+            self._insert(event)
+        event_manager.add_listener(self.on_event_changed)
+
+    def detach(self):
+        if self._event_manager is not None:
+            self._event_manager.remove_listener(self.on_event_changed)
+        self._event_manager = None
+        self._keys = []
+        self._row_keys = {}
+        self._tree.delete(*self._tree.get_children())
+
+    def on_event_changed(self, action, event):
+        if action == self._event_manager.CREATED:
+            self._insert(event)
+        elif action == self._event_manager.UPDATED:
+            self._update(event)
+        elif action == self._event_manager.DELETED:
+            self._remove(event.event_id)
+
+    def row(self, event):
+        event_manager = self._event_manager
+        start_time = frame_id_to_time_stamp(event.start_idx, self._video_fps)
+        end_time = frame_id_to_time_stamp(event.end_idx, self._video_fps) if event.end_idx is not None else '-'
+        team_name = event_manager.teams[event.team_key] if event.team_key is not None else '-'
+        event_type = event_manager.event_types.compiled.label(event.type_code)
+
+        return [event.event_id, event_type, team_name, start_time, end_time, event.start_idx, event.end_idx]
+
+    def index_of(self, event_id):
+        key = self._row_keys.get(event_id, None)
+        return bisect.bisect_left(self._keys, key) if key is not None else None
+
+    def event_id_at(self, index):
+        return -self._keys[index][1]
+
+    def selected_event_ids(self):
+        return [int(iid) for iid in self._tree.selection()]
+
+    def select(self, event_id):
+        if event_id in self._row_keys:
+            self._tree.selection_set(str(event_id))
+            self._tree.see(str(event_id))
+
+    def _insert(self, event):
+        key = (-event.start_idx, -event.event_id)
+        index = bisect.bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._row_keys[event.event_id] = key
+        self._tree.insert('', index, iid=str(event.event_id), values=self.row(event))
+
+    def _update(self, event):
+        key = (-event.start_idx, -event.event_id)
+        if self._row_keys.get(event.event_id, None) != key:
+            # The start frame changed, so the row has to be moved:
+            self._remove(event.event_id)
+            self._insert(event)
+        else:
+            self._tree.item(str(event.event_id), values=self.row(event))
+
+    def _remove(self, event_id):
+        key = self._row_keys.pop(event_id, None)
+        if key is None:
+            return
+        del self._keys[bisect.bisect_left(self._keys, key)]
+        self._tree.delete(str(event_id))
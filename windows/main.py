@@ -4,6 +4,7 @@ from PySimpleGUI import TITLE_LOCATION_TOP
 
 from event_manager import EventManager
 from windows.utils import frame_id_to_time_stamp, show_conformation_window
+from windows.event_table import EventTableModel
 from event_types import EventTypes
 
 
@@ -13,10 +14,12 @@ SPEED_DEFAULT = 'Обычная'
 
 class WindowMain:
     def __init__(self, event_types : EventTypes, video_dir=''):
+        self._event_types = event_types
         self._new_events = {}
-        self.event_list = []
         self.selected_event = None
+        self._active_events_text = None
         self.window = self.create_window(event_types, video_dir)
+        self.event_table = EventTableModel(self.window['-EVENT_TABLE-'])
         self._osx = False if 'Linux' in platform.system() or 'Windows' in platform.system() else True
 
 
@@ -73,7 +76,9 @@ class WindowMain:
             ], justification='center'),
             sg.Column([[
                 sg.Text('{}/{}'.format(0, 0), key='text_counter'),
-                sg.Text('FPS: 0', key='text_fps')]
+                sg.Text('FPS: 0', key='text_fps'),
+                sg.Text('', key='text_seek'),
+                sg.Text('', key='text_autosave')]
             ], justification='left')
         ]
         # Create event table:
@@ -99,18 +104,19 @@ class WindowMain:
             [sg.Image(key='image_canvas')],
             [sg_slider],
             navigation_panel,
+            [sg.Text('', key='-ACTIVE_EVENTS-', text_color='lime', expand_x=True)],
             [sg_event_table]
             ], vertical_alignment = 'top', expand_x=False, expand_y=True
         )
 
-        # Right column (event_creation + event_editing panels):
-        event_creation_layout, self._new_events = self.create_layout_event_creation(event_types)
+        # Right column (event_creation + event_editing panels), event buttons are added by build_event_panels():
         sg_right_column = sg.Column([
-            [sg.Frame('', event_creation_layout,
+            [sg.Frame('', [[]], key='-EVENT_CREATION_LAYOUT-',
                       element_justification='center', vertical_alignment='top', expand_x=True, border_width=1)],
             [sg.Frame('', self.create_layout_edit_event(), key='-EDIT_EVENT_LAYOUT-',
                       element_justification='center', vertical_alignment='top', visible=True, expand_x=True, border_width=1)]
-            ], vertical_alignment='top', expand_x=False, expand_y=True, vertical_scroll_only=True, scrollable=True
+            ], key='-RIGHT_COLUMN-', vertical_alignment='top', expand_x=False, expand_y=True,
+            vertical_scroll_only=True, scrollable=True
         )
 
         # All the stuff inside the window:
@@ -135,6 +141,18 @@ class WindowMain:
         return window
 
 
+    def build_event_panels(self):
+        '''
+        Adds event creation buttons of the whole taxonomy, they are built only when the first video is opened
+        '''
+        if len(self._new_events) > 0:
+            return False
+        event_creation_layout, self._new_events = self.create_layout_event_creation(self._event_types)
+        self.window.extend_layout(self.window['-EVENT_CREATION_LAYOUT-'], event_creation_layout)
+        self.window['-RIGHT_COLUMN-'].contents_changed()
+        return True
+
+
     def press_event_creation_button(self, event_manager : EventManager, frame_id : int, button_key : str):
         assert button_key in self._new_events
         event_id = self._new_events[button_key]
@@ -153,19 +171,17 @@ class WindowMain:
             self._recolor_button(self.window[button_key], highlight=False)
 
 
-    def refresh_edit_event_layout(self, event_manager, video_fps, selected_row):
-        if len(selected_row) == 0:
+    def refresh_edit_event_layout(self, event_manager, video_fps):
+        selected_ids = self.event_table.selected_event_ids()
+        if len(selected_ids) == 0:
             self.selected_event = None
             return
 
         # Find event:
-        selected_row_id = int(selected_row[0])
-        event_id = self.event_list[selected_row_id][0]
-        self.selected_event = event_manager.get_event(event_id)
+        self.selected_event = event_manager.get_event(selected_ids[0])
 
         # Event type:
-        supertype = event_manager.event_types.supertypes[self.selected_event.supertype]
-        event_type = '{} - {}'.format(supertype.alias, supertype.types[self.selected_event.type].alias)
+        event_type = event_manager.event_types.compiled.label(self.selected_event.type_code)
 
         # Refresh data in the panel:
         self.window['-EDIT_EVENT_ID-'].update(self.selected_event.event_id)
@@ -190,71 +206,73 @@ class WindowMain:
 
 
     def refresh_event_table(self, event_manager, video_fps, select_rows=None):
-        # Update event list:
-        self.event_list = []
-        for event_id, event in event_manager.events.items():
-            start_time = frame_id_to_time_stamp(event.start_idx, video_fps)
-            end_time = frame_id_to_time_stamp(event.end_idx, video_fps) if event.end_idx is not None else '-'
-            team_name = event_manager.teams[event.team_key] if event.team_key is not None else '-'
-            supertype = event_manager.event_types.supertypes[event.supertype]
-            event_type = '{} - {}'.format(supertype.alias, supertype.types[event.type].alias)
-            self.event_list.append(
-                [event_id, event_type, team_name, start_time, end_time, event.start_idx, event.end_idx]
-            )
-        self.event_list = sorted(self.event_list, key=lambda x: x[3], reverse=True)
-
-        # Find event in event table:
-        if select_rows is None and self.selected_event is not None:
-            for i, event in enumerate(self.event_list):
-                if event[0] == self.selected_event.event_id:
-                    select_rows = [i]
-                    break
-
-        # Selet row:
-        if select_rows is not None and len(self.event_list) <= select_rows[0]:
-            select_rows = [len(self.event_list)-1] if len(self.event_list) > 0 else None
-
-        # Update table:
-        self.window['-EVENT_TABLE-'].update(values=self.event_list, select_rows=select_rows)
+        # Rows are updated by change notifications of the manager, so the table is only built once:
+        if self.event_table.event_manager is not event_manager:
+            self.event_table.attach(event_manager, video_fps)
+
+        # Select row (by index after deletion or the selected event otherwise):
+        if select_rows is not None:
+            if len(self.event_table) > 0:
+                self.event_table.select(self.event_table.event_id_at(min(select_rows[0], len(self.event_table)-1)))
+        elif self.selected_event is not None:
+            self.event_table.select(self.selected_event.event_id)
+
+
+    def show_active_events(self, event_manager, frame_id):
+        '''
+        Highlights events overlapping the current frame
+        '''
+        labels = []
+        if event_manager is not None:
+            compiled = event_manager.event_types.compiled
+            for event in event_manager.events_at(frame_id):
+                labels.append('{}: {}'.format(event.event_id, compiled.label(event.type_code)))
+        text = '   '.join(labels)
+
+        # Avoid redrawing the same text every frame:
+        if text != self._active_events_text:
+            self._active_events_text = text
+            self.window['-ACTIVE_EVENTS-'].update(value=text)
 
 
     def clean_evant_table(self):
-        self.event_list = []
-        self.window['-EVENT_TABLE-'].update(values=self.event_list)
+        self.event_table.detach()
 
 
     def update_selected_event(self, event_manager, action):
         if self.selected_event is None:
             return False
 
+        # Update through the manager, so that its listeners are notified:
+        event_id = self.selected_event.event_id
         if action == '-EDIT_EVENT_TEAM-':
             team_name = self.window['-EDIT_EVENT_TEAM-'].get()
-            self.selected_event.team_key = event_manager.team_name_to_key[team_name]
+            event_manager.update_event(event_id, team_key=event_manager.team_name_to_key[team_name])
         elif action == '-EDIT_EVENT_PLAYERS-':
-            self.selected_event.players = self.window[action].get()
+            event_manager.update_event(event_id, players=self.window[action].get())
         elif action == '-EDIT_EVENT_ENEMY_PLAYERS-':
-            self.selected_event.enemy_players = self.window[action].get()
+            event_manager.update_event(event_id, enemy_players=self.window[action].get())
         elif action == '-EDIT_EVENT_START_ZONE-':
-            self.selected_event.start_zone = self.window[action].get()
+            event_manager.update_event(event_id, start_zone=self.window[action].get())
         elif action == '-EDIT_EVENT_END_ZONE-':
-            self.selected_event.end_zone = self.window[action].get()
+            event_manager.update_event(event_id, end_zone=self.window[action].get())
         elif action == '-EDIT_EVENT_START_CAUSE-':
-            self.selected_event.start_cause = self.window[action].get()
+            event_manager.update_event(event_id, start_cause=self.window[action].get())
         elif action == '-EDIT_EVENT_END_CAUSE-':
-            self.selected_event.end_cause = self.window[action].get()
+            event_manager.update_event(event_id, end_cause=self.window[action].get())
 
         return True
 
 
-    def set_event_time(self, video_fps, start_frame=None, end_frame=None):
+    def set_event_time(self, event_manager, video_fps, start_frame=None, end_frame=None):
         if self.selected_event is None:
             return False
 
+        # Update through the manager to keep its event index in sync:
+        event_manager.update_event(self.selected_event.event_id, start_idx=start_frame, end_idx=end_frame)
         if start_frame is not None:
-            self.selected_event.start_idx = start_frame
             self.window['-EDIT_EVENT_MOVE_TO_START-'].update(frame_id_to_time_stamp(start_frame, video_fps))
         if end_frame is not None:
-            self.selected_event.end_idx = end_frame
             self.window['-EDIT_EVENT_MOVE_TO_END-'].update(frame_id_to_time_stamp(end_frame, video_fps))
             # Finish new event if it is active:
             key = '-CREATE_EVENT={}+{}'.format(self.selected_event.supertype, self.selected_event.type)
@@ -290,12 +308,9 @@ class WindowMain:
         header = 'Подтвереждение удаления ивента'
         message = 'Вы действительно хотите удалить ивент ID:{} [{}]'.format(event_id, event_type)
         if show_conformation_window(header, message):
+            row_index = self.event_table.index_of(event_id)
             if event_manager.delete_event(event_id):
-                # Find row index:
-                for i, event in enumerate(self.event_list):
-                    if int(event[0]) == event_id:
-                        deleted_rows = [i]
-                        break
+                deleted_rows = [row_index] if row_index is not None else None
                 # Delete event from new_events:
                 for button_key, new_event_id in self._new_events.items():
                     if event_id == new_event_id:
@@ -1,15 +1,59 @@
+import time
 import datetime
-import cv2
 from PIL import Image, ImageTk
 import PySimpleGUI as sg
 
 
-def image_np_to_pil(cv_img):
-    cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-    img_pil = Image.fromarray(cv_img)
-    # window['image'](data=cv2.imencode('.png', cap.read()[1])[1].tobytes())
+class FrameDisplay:
+    '''
+    Shows RGB frames on sg.Image through one persistent PhotoImage.
+    Pixels are blitted straight from the frame memory (e.g. a shared buffer slot) without numpy copies
+    '''
+    def __init__(self, sg_image):
+        self._sg_image = sg_image
+        self._photo = None
+        self._size = None
+        self.last_ms = 0.0                     # time spent to show the last frame
+        self._total_ms = 0.0
+        self._count = 0
 
-    return ImageTk.PhotoImage(img_pil)
+    def show(self, rgb_img):
+        size = (rgb_img.shape[1], rgb_img.shape[0])
+        self.show_pil(Image.frombuffer('RGB', size, rgb_img, 'raw', 'RGB', 0, 1))
+
+    def show_preview(self, rgb_img, width, height):
+        '''
+        Shows a small image (e.g. a thumbnail) scaled to the frame size
+        '''
+        size = (rgb_img.shape[1], rgb_img.shape[0])
+        img_pil = Image.frombuffer('RGB', size, rgb_img, 'raw', 'RGB', 0, 1)
+        self.show_pil(img_pil.resize((width, height), Image.BILINEAR))
+
+    def clear(self, width, height):
+        '''
+        Shows a black frame (doesn't need numpy, so it's used before heavy modules are loaded)
+        '''
+        self.show_pil(Image.new('RGB', (width, height)))
+
+    def show_pil(self, img_pil):
+        start = time.perf_counter_ns()
+
+        size = img_pil.size
+        if self._photo is None or size != self._size:
+            # PhotoImage is recreated only when the frame size changes:
+            self._photo = ImageTk.PhotoImage(img_pil)
+            self._size = size
+            self._sg_image.update(data=self._photo)
+        else:
+            self._photo.paste(img_pil)
+
+        self.last_ms = (time.perf_counter_ns() - start) / 1e6
+        self._total_ms += self.last_ms
+        self._count += 1
+
+    @property
+    def mean_ms(self):
+        return self._total_ms / self._count if self._count > 0 else 0.0
 
 
 def frame_id_to_time_stamp(frame_id, video_fps):